@@ -0,0 +1,173 @@
+import hashlib
+import os
+import re
+from array import array
+from config import *
+from validator import LEGACY_OPCODES
+from vm import (VMError, OPERAND_BASE, WORD_MODULUS, WORD_TYPECODE, format_word, READ, WRITE, LOAD,
+                STORE, ADD, SUBTRACT, DIVIDE, MULTIPLY, BRANCH, BRANCHNEG, BRANCHZERO, HALT)
+
+MNEMONICS = {
+    "READ": READ,
+    "WRITE": WRITE,
+    "LOAD": LOAD,
+    "STORE": STORE,
+    "ADD": ADD,
+    "SUBTRACT": SUBTRACT,
+    "DIVIDE": DIVIDE,
+    "MULTIPLY": MULTIPLY,
+    "BRANCH": BRANCH,
+    "BRANCHNEG": BRANCHNEG,
+    "BRANCHZERO": BRANCHZERO,
+    "HALT": HALT
+}
+
+# Bump when the encoding changes so stale cache entries are never reused
+ASSEMBLER_VERSION = 2
+ASSEMBLY_SUFFIX = ".asm"
+CACHE_DIGEST_SIZE = hashlib.sha256().digest_size
+LABEL = re.compile(r"[A-Za-z_][A-Za-z0-9_]*$")
+
+class AssemblyError(VMError):
+    """Raised when mnemonic source cannot be assembled."""
+    def __init__(self, line: int, message: str):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+class Assembly:
+    '''Result of assembling a program: the word image plus what produced it'''
+    def __init__(self, words: array, symbols: dict, instructions: set):
+        self.words = words
+        self.symbols = symbols
+        self.instructions = instructions
+
+    def to_text(self, word_length: int = WORD_LENGTH) -> str:
+        '''BasicML text, one word per line, in 6-digit or legacy 4-digit form'''
+        if word_length == WORD_LENGTH:
+            return "\n".join(format_word(word) for word in self.words) + "\n"
+        lines = []
+        for address, word in enumerate(self.words):
+            sign = "-" if word < 0 else "+"
+            if address in self.instructions:
+                opcode, operand = divmod(abs(word), OPERAND_BASE)
+                lines.append(f"{sign}{opcode:02d}{operand:02d}")
+            else:
+                lines.append(f"{sign}{abs(word):04d}")
+        return "\n".join(lines) + "\n"
+
+def parse_line(text: str):
+    '''Split a source line into (label, mnemonic, operand), any of which may be None'''
+    code = re.split(r"[#;]", text, maxsplit=1)[0].strip()
+    label = None
+    if ":" in code:
+        label, code = (part.strip() for part in code.split(":", 1))
+    parts = code.split()
+    if len(parts) > 2:
+        raise ValueError(f"Unexpected text after operand: {' '.join(parts[2:])}")
+    mnemonic = parts[0].upper() if parts else None
+    operand = parts[1] if len(parts) == 2 else None
+    return label, mnemonic, operand
+
+def assemble(source: str, word_length: int = WORD_LENGTH) -> Assembly:
+    '''Assemble mnemonic source into a word image in two passes.
+
+    Each line holds an optional "label:", then a mnemonic with its operand
+    (LOAD x, BRANCHNEG end, HALT) or "DATA value". Operands are addresses or
+    labels; everything after # or ; is a comment. The first pass assigns an
+    address to every statement and collects the labels, the second encodes the
+    words. word_length 4 restricts addresses and data to the legacy format.
+    '''
+    max_address = MEMORY_LENGTH - 1 if word_length == WORD_LENGTH else 99
+    max_data = WORD_MODULUS - 1 if word_length == WORD_LENGTH else 9999
+
+    # Pass 1: addresses and symbols
+    statements = []
+    symbols = {}
+    for number, text in enumerate(source.splitlines(), 1):
+        try:
+            label, mnemonic, operand = parse_line(text)
+        except ValueError as e:
+            raise AssemblyError(number, str(e)) from None
+        if label is not None:
+            if not LABEL.match(label):
+                raise AssemblyError(number, f"Invalid label: {label}")
+            if label in symbols:
+                raise AssemblyError(number, f"Duplicate label: {label}")
+            symbols[label] = len(statements)
+        if mnemonic is not None:
+            statements.append((number, mnemonic, operand))
+    if len(statements) > max_address + 1:
+        raise AssemblyError(statements[max_address + 1][0], ERR_PROGRAM_TOO_LARGE)
+
+    # Pass 2: encode
+    words = array(WORD_TYPECODE)
+    instructions = set()
+    for number, mnemonic, operand in statements:
+        if mnemonic == "DATA":
+            value = resolve(operand, symbols, number, -max_data, max_data)
+            # The legacy loader reads any 4-digit word that starts with an opcode as an instruction
+            if word_length != WORD_LENGTH and f"{abs(value):04d}"[:2] in LEGACY_OPCODES:
+                raise AssemblyError(number, f"DATA {operand} would load as an instruction in the 4-digit format")
+            words.append(value)
+            continue
+        if mnemonic not in MNEMONICS:
+            raise AssemblyError(number, f"Unknown mnemonic: {mnemonic}")
+        opcode = MNEMONICS[mnemonic]
+        address = 0 if opcode == HALT and operand is None else resolve(operand, symbols, number, 0, max_address)
+        instructions.add(len(words))
+        words.append(opcode * OPERAND_BASE + address)
+    return Assembly(words, symbols, instructions)
+
+def resolve(operand: str, symbols: dict, line: int, low: int, high: int) -> int:
+    if operand is None:
+        raise AssemblyError(line, "Missing operand")
+    if operand in symbols:
+        value = symbols[operand]
+    else:
+        try:
+            value = int(operand)
+        except ValueError:
+            raise AssemblyError(line, f"Undefined symbol: {operand}") from None
+    if not low <= value <= high:
+        raise AssemblyError(line, f"Operand out of range: {operand}")
+    return value
+
+def source_hash(source: str, word_length: int = WORD_LENGTH) -> str:
+    '''Cache key for source: changes with the text, the word length and the assembler version'''
+    key = f"{ASSEMBLER_VERSION}:{word_length}:{source}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def assemble_cached(source: str, word_length: int = WORD_LENGTH, cache_dir: str = ASSEMBLER_CACHE_DIR) -> array:
+    '''Return the word image for source, assembling only if no cached image exists for its hash.
+
+    Each entry is the SHA-256 of its word bytes followed by the words. The cache
+    only ever saves work: an unreadable, truncated or corrupted entry is a miss,
+    and failing to write one (a read-only directory, say) is ignored.
+    '''
+    path = os.path.join(cache_dir, source_hash(source, word_length) + ".words")
+    try:
+        with open(path, "rb") as f:
+            entry = f.read()
+    except OSError:
+        entry = b""
+    digest, data = entry[:CACHE_DIGEST_SIZE], entry[CACHE_DIGEST_SIZE:]
+    if len(digest) == CACHE_DIGEST_SIZE and len(data) % 8 == 0 and hashlib.sha256(data).digest() == digest:
+        words = array(WORD_TYPECODE)
+        words.frombytes(data)
+        return words
+
+    words = assemble(source, word_length).words
+    data = words.tobytes()
+    # Write then rename, so concurrent batch workers never read a half-written entry
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(temporary, "wb") as f:
+            f.write(hashlib.sha256(data).digest() + data)
+        os.replace(temporary, path)
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+    return words
@@ -0,0 +1,117 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from vm import VMPool, ProgramLoader
+from channels import ListChannel, ScriptedInput
+from sources import PROGRAM_SUFFIXES, archive_members, is_archive, program_name
+
+# Each worker process reuses its VMs across every program it runs
+vm_pool = VMPool()
+
+def load_inputs(filepath: str) -> dict:
+    '''Read input vectors from a JSON file.
+
+    The file holds either a list of vectors used for every program, or an object
+    mapping program file names to their own list of vectors, with "*" as the
+    fallback for programs that are not listed.
+    '''
+    with open(filepath, "r") as f:
+        inputs = json.load(f)
+    if isinstance(inputs, list):
+        return {"*": inputs}
+    return inputs
+
+def find_programs(directory: str) -> list:
+    '''Programs in a directory, or in a .zip or .tar archive without extracting it'''
+    if is_archive(directory):
+        return archive_members(directory)
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(PROGRAM_SUFFIXES))
+
+def run_program(filepath: str, vectors: list, max_steps: int = None, detect_loops: bool = False) -> list:
+    '''Load a program once and run a forked VM per input vector, returning one record per vector'''
+    start = time.perf_counter()
+    try:
+        with vm_pool.borrow() as vm:
+            ProgramLoader().load(vm, filepath)
+            image = vm.snapshot()
+    except Exception as e:
+        wall_time = time.perf_counter() - start
+        with vm_pool.borrow() as vm:
+            return [result_record(filepath, index, vm, [], e, wall_time) for index in range(len(vectors))]
+    return [run_image(image, filepath, vector, index, max_steps, detect_loops)
+            for index, vector in enumerate(vectors)]
+
+def run_image(image, filepath: str, vector: list, index: int = 0,
+              max_steps: int = None, detect_loops: bool = False) -> dict:
+    '''Run one input vector on a VM forked from a loaded program image'''
+    output = ListChannel()
+    vm = vm_pool.fork(image)
+    try:
+        vm.max_steps = max_steps
+        vm.detect_loops = detect_loops
+        vm.set_io(ScriptedInput(vector), output)
+        error = None
+        start = time.perf_counter()
+        try:
+            vm.run()
+        except Exception as e:
+            error = e
+        wall_time = time.perf_counter() - start
+        return result_record(filepath, index, vm, output.outputs, error, wall_time)
+    finally:
+        vm_pool.release(vm)
+
+def result_record(filepath: str, index: int, vm, outputs: list, error: Exception, wall_time: float) -> dict:
+    halted = error is None
+    if halted and outputs and outputs[-1] == "HALT.":
+        outputs.pop()
+    return {
+        "program": program_name(filepath),
+        "input": index,
+        "outputs": [line for line in outputs if line],
+        "halted": halted,
+        "accumulator": vm.accumulator,
+        "program_counter": vm.program_counter,
+        "instructions": vm.instruction_count,
+        "overflows": vm.overflow_count,
+        "error": type(error).__name__ if error else None,
+        "message": str(error) if error else None,
+        "wall_time": wall_time
+    }
+
+def run_chunk(jobs: list, max_steps: int = None, detect_loops: bool = False) -> list:
+    '''Worker entry point: run a chunk of (filepath, vectors) jobs'''
+    results = []
+    for filepath, vectors in jobs:
+        results += run_program(filepath, vectors, max_steps, detect_loops)
+    return results
+
+def run_corpus(programs: list, inputs: dict = None, jobs: int = 1, chunk_size: int = 16,
+               max_steps: int = None, detect_loops: bool = False):
+    '''Run every program against its input vectors, yielding result records as they finish.
+
+    With jobs > 1 the programs are split into chunks of chunk_size and handed to
+    a pool of worker processes that stay alive for the whole corpus, so each
+    task pickles one chunk instead of one program. max_steps and detect_loops
+    bound runaway programs (see VM.run).
+    '''
+    inputs = inputs or {}
+    work = [(filepath, inputs.get(program_name(filepath), inputs.get("*", [[]])))
+            for filepath in programs]
+    chunks = [work[i:i + chunk_size] for i in range(0, len(work), chunk_size)]
+
+    if jobs <= 1:
+        for chunk in chunks:
+            yield from run_chunk(chunk, max_steps, detect_loops)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_chunk, chunk, max_steps, detect_loops) for chunk in chunks]
+        for future in as_completed(futures):
+            yield from future.result()
+
+def write_jsonl(results, stream):
+    for result in results:
+        stream.write(json.dumps(result) + "\n")
+        stream.flush()
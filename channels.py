@@ -0,0 +1,71 @@
+import sys
+from vm import InputExhaustedError
+
+class Channel:
+    '''Where a VM's READs come from and its WRITEs go.
+
+    A VM calls read(prompt) for every READ and write(text) for every output.
+    Channels belong to one VM, so many VMs can run side by side in one process
+    without touching sys.stdin or sys.stdout. Attach them with VM.set_io.
+    '''
+    def read(self, prompt: str = "") -> str:
+        raise InputExhaustedError("No input left for READ")
+
+    def write(self, text: str):
+        pass
+
+class NullChannel(Channel):
+    '''Discards output and has no input'''
+    pass
+
+class ConsoleChannel(Channel):
+    '''Reads lines from a terminal and writes each output on its own line'''
+    def __init__(self, stdin=None, stdout=None):
+        self.stdin = stdin or sys.stdin
+        self.stdout = stdout or sys.stdout
+
+    def read(self, prompt: str = "") -> str:
+        if prompt:
+            self.stdout.write(prompt)
+            self.stdout.flush()
+        line = self.stdin.readline()
+        if not line:
+            raise InputExhaustedError("No input left for READ")
+        return line.rstrip("\n")
+
+    def write(self, text: str):
+        self.stdout.write(text if text.endswith("\n") else text + "\n")
+
+class FileChannel(ConsoleChannel):
+    '''Reads input lines from one open text file and writes output to another, without prompts'''
+    def __init__(self, input_file=None, output_file=None):
+        self.stdin = input_file
+        self.stdout = output_file
+
+    def read(self, prompt: str = "") -> str:
+        if self.stdin is None:
+            raise InputExhaustedError("No input left for READ")
+        return super().read()
+
+    def write(self, text: str):
+        if self.stdout is not None:
+            super().write(text)
+
+class ListChannel(Channel):
+    '''Collects each output in a list, without its trailing newline'''
+    def __init__(self):
+        self.outputs = []
+
+    def write(self, text: str):
+        self.outputs.append(text.rstrip("\n"))
+
+class ScriptedInput(Channel):
+    '''Answers READs from a prepared sequence of values and fails once it runs out'''
+    def __init__(self, values):
+        self.values = iter(values)
+
+    def read(self, prompt: str = "") -> str:
+        try:
+            return str(next(self.values))
+        except StopIteration:
+            raise InputExhaustedError("No input left for READ") from None
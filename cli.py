@@ -0,0 +1,181 @@
+import argparse
+import sys
+import time
+from contextlib import ExitStack
+
+# Exit codes of the run command
+EXIT_OK = 0
+EXIT_RUNTIME_ERROR = 1
+EXIT_USAGE = 2
+EXIT_LOAD_ERROR = 3
+EXIT_STEP_LIMIT = 4
+EXIT_INFINITE_LOOP = 5
+EXIT_INPUT_EXHAUSTED = 6
+
+def run_command(args) -> int:
+    '''Run one program headlessly: WRITEs stream to stdout, READs come from --input or stdin'''
+    from vm import (VM, ProgramLoader, StepLimitExceededError, InfiniteLoopError,
+                    InputExhaustedError, TRACE_HEADER)
+    from channels import FileChannel, ListChannel
+
+    # run() takes the loop-detecting interpreter ahead of any tracing or engine
+    if args.detect_loops and (args.trace or args.engine != "interpreter"):
+        print("--detect-loops cannot be combined with --trace or --engine", file=sys.stderr)
+        return EXIT_USAGE
+
+    vm = VM(engine=args.engine)
+    try:
+        ProgramLoader().load(vm, sys.stdin if args.program == "-" else args.program)
+    except Exception as e:
+        print(f"{args.program}: {e}", file=sys.stderr)
+        return EXIT_LOAD_ERROR
+
+    with ExitStack() as files:
+        try:
+            input_file = files.enter_context(open(args.input, "r")) if args.input and args.input != "-" else sys.stdin
+            trace = files.enter_context(open(args.trace, "wb")) if args.trace else None
+        except OSError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return EXIT_USAGE
+        output = ListChannel() if args.json else FileChannel(output_file=sys.stdout)
+        vm.set_io(FileChannel(input_file), output)
+        vm.max_steps = args.max_steps
+        vm.detect_loops = args.detect_loops
+        if trace is not None:
+            trace.write(TRACE_HEADER)
+            vm.trace = trace
+
+        error = None
+        start = time.perf_counter()
+        try:
+            vm.run()
+        except Exception as e:
+            error = e
+        wall_time = time.perf_counter() - start
+
+    if args.json:
+        import json
+        from batch import result_record
+        print(json.dumps(result_record(args.program, 0, vm, output.outputs, error, wall_time)))
+    elif error is not None:
+        print(f"Error: {error}", file=sys.stderr)
+
+    if error is None:
+        return EXIT_OK
+    if isinstance(error, StepLimitExceededError):
+        return EXIT_STEP_LIMIT
+    if isinstance(error, InfiniteLoopError):
+        return EXIT_INFINITE_LOOP
+    if isinstance(error, InputExhaustedError):
+        return EXIT_INPUT_EXHAUSTED
+    return EXIT_RUNTIME_ERROR
+
+def batch_command(args) -> int:
+    from batch import find_programs, load_inputs, run_corpus, write_jsonl
+    inputs = load_inputs(args.inputs) if args.inputs else None
+    results = run_corpus(find_programs(args.directory), inputs, args.jobs, args.chunk_size,
+                         args.max_steps, args.detect_loops)
+    write_jsonl(results, sys.stdout)
+    return 0
+
+def compile_command(args) -> int:
+    '''Write each text program as a binary image, so later runs skip parsing'''
+    import os
+    from vm import ProgramLoader
+    from image import IMAGE_SUFFIX
+    loader = ProgramLoader()
+    status = EXIT_OK
+    for program in args.programs:
+        image_path = None
+        if args.out_dir:
+            os.makedirs(args.out_dir, exist_ok=True)
+            name = os.path.splitext(os.path.basename(program))[0] + IMAGE_SUFFIX
+            image_path = os.path.join(args.out_dir, name)
+        try:
+            print(loader.compile_image(program, image_path))
+        except Exception as e:
+            print(f"{program}: {e}", file=sys.stderr)
+            status = EXIT_LOAD_ERROR
+    return status
+
+def lint_command(args) -> int:
+    '''Report every problem in each text program, one "file:line:column: code: message" line each'''
+    from vm import ProgramLoader
+    loader = ProgramLoader()
+    status = EXIT_OK
+    for program in args.programs:
+        try:
+            diagnostics = loader.check(program).diagnostics
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"{program}: {e}", file=sys.stderr)
+            status = EXIT_LOAD_ERROR
+            continue
+        for diagnostic in diagnostics:
+            print(f"{program}:{diagnostic.line}:{diagnostic.column}: {diagnostic.code}: {diagnostic.message}")
+        if diagnostics:
+            status = EXIT_LOAD_ERROR
+    return status
+
+def migrate_command(args) -> int:
+    '''Convert every legacy 4-digit program under a directory, printing one JSON line per file'''
+    import json
+    from migrate import convert_tree, FAILED
+    status = EXIT_OK
+    for record in convert_tree(args.directory, args.out_dir, args.jobs, args.chunk_size):
+        print(json.dumps(record), flush=True)
+        if record["status"] == FAILED:
+            status = EXIT_LOAD_ERROR
+    return status
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="vm", description="Run BasicML programs without the GUI.")
+    commands = parser.add_subparsers(dest="command")
+
+    run = commands.add_parser("run", help="Run one program, streaming its output to stdout")
+    run.add_argument("program", help="Program file to run, a member such as class.zip/alice.txt, or - for stdin")
+    run.add_argument("--input", help="File of READ values, one per line (default: stdin)")
+    run.add_argument("--max-steps", type=int, default=None, help="Instruction budget for the run")
+    run.add_argument("--detect-loops", action="store_true",
+                     help="Stop as soon as the program provably loops forever (interpreter only, no --trace)")
+    run.add_argument("--engine", choices=("interpreter", "block", "trace"), default="interpreter",
+                     help="Execution engine (--trace always interprets)")
+    run.add_argument("--trace", help="Write a binary trace of every executed instruction to this file")
+    run.add_argument("--json", action="store_true", help="Print one JSON result record instead of the raw output")
+    run.set_defaults(handler=run_command)
+
+    batch = commands.add_parser("batch", help="Run every program in a directory and print JSONL results")
+    batch.add_argument("directory", help="Directory, .zip or .tar archive of programs")
+    batch.add_argument("--inputs", help="JSON file of READ input vectors")
+    batch.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes")
+    batch.add_argument("--chunk-size", type=int, default=16, help="Programs sent to a worker at a time")
+    batch.add_argument("--max-steps", type=int, default=1_000_000, help="Instruction budget per run")
+    batch.add_argument("--detect-loops", action="store_true", help="Stop runs as soon as they provably loop forever")
+    batch.set_defaults(handler=batch_command)
+
+    compiler = commands.add_parser("compile", help="Convert text programs into binary program images")
+    compiler.add_argument("programs", nargs="+", help="Text program files")
+    compiler.add_argument("-o", "--out-dir", help="Directory for the images (default: next to each program)")
+    compiler.set_defaults(handler=compile_command)
+
+    lint = commands.add_parser("lint", help="Check text programs and list every problem found")
+    lint.add_argument("programs", nargs="+", help="Text program files")
+    lint.set_defaults(handler=lint_command)
+
+    migrate = commands.add_parser("migrate", help="Convert a directory tree of 4-digit programs to 6 digits")
+    migrate.add_argument("directory", help="Directory searched recursively for .txt programs")
+    migrate.add_argument("-o", "--out-dir", help="Write converted files into this tree instead of in place")
+    migrate.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes")
+    migrate.add_argument("--chunk-size", type=int, default=64, help="Files sent to a worker at a time")
+    migrate.set_defaults(handler=migrate_command)
+    return parser
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return EXIT_USAGE
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+from config import *
+from vm import (OPERAND_BASE, WORD_MODULUS, READ, WRITE, LOAD, STORE, ADD, SUBTRACT,
+                DIVIDE, MULTIPLY, BRANCH, BRANCHNEG, BRANCHZERO, HALT)
+
+BRANCH_OPS = (BRANCH, BRANCHNEG, BRANCHZERO)
+TERMINATORS = BRANCH_OPS + (HALT,)
+OVERFLOWING_OPS = (ADD, SUBTRACT, MULTIPLY)
+
+def sync(pc: int, executed: int) -> list:
+    '''Source lines that write the local state back to the VM after executed instructions'''
+    return ["vm.accumulator = acc", f"vm.program_counter = {pc}", f"vm.instruction_count = count + {executed}"]
+
+def exit_to(pc: int, executed: int) -> list:
+    return sync(pc, executed) + [f"return {pc}"]
+
+def indent(lines: list, depth: int = 1) -> list:
+    return [("    " * depth) + line for line in lines]
+
+def emit_operation(address: int, opcode: int, operand: int, executed: int) -> list:
+    '''Generate the source lines for one non-branching instruction, the executed-th of its function'''
+    following = address + 1
+    lines = [f"# {address:03d}: {opcode:03d} {operand:03d}"]
+
+    if opcode == LOAD:
+        lines.append(f"acc = mem[{operand}]")
+    elif opcode == ADD:
+        lines.append(f"acc += mem[{operand}]")
+    elif opcode == SUBTRACT:
+        lines.append(f"acc -= mem[{operand}]")
+    elif opcode == MULTIPLY:
+        lines.append(f"acc *= mem[{operand}]")
+    elif opcode == DIVIDE:
+        lines += [f"divisor = mem[{operand}]",
+                  "if divisor == 0:",
+                  *indent(sync(following, executed)),
+                  "    raise ZeroDivisionError('Cannot divide by zero')",
+                  "quotient = abs(acc) // abs(divisor)",
+                  "acc = quotient if (acc < 0) == (divisor < 0) else -quotient"]
+    elif opcode == STORE:
+        lines += [f"mem[{operand}] = acc",
+                  f"dec[{operand}] = None",
+                  f"dirty.add({operand})",
+                  f"if owners[{operand}]:",
+                  f"    invalidate({operand})"]
+    elif opcode in (READ, WRITE):
+        lines += sync(following, executed)
+        lines.append(f"vm.{'read_op' if opcode == READ else 'write_op'}({operand})")
+
+    if opcode in OVERFLOWING_OPS:
+        lines += [f"if acc >= {WORD_MODULUS} or acc <= -{WORD_MODULUS}:",
+                  "    acc = vm.overflow(acc)"]
+    return lines
+
+class CodeCache:
+    '''Bookkeeping shared by the compiling engines.
+
+    Compiled functions are stored by entry address, and owners maps every
+    address a function was compiled from back to the entry addresses that
+    depend on it, so a write to memory drops only the affected functions.
+    '''
+    def __init__(self, vm):
+        self.vm = vm
+        self.flush()
+
+    def flush(self):
+        '''Drop all compiled code, e.g. after the VM's memory buffer was replaced'''
+        self.words = self.vm._words
+        self.compiled = [None] * MEMORY_LENGTH
+        self.owners = [None] * MEMORY_LENGTH
+
+    def mark_stale(self):
+        '''Flush before the next run, once the new memory contents are in place'''
+        self.words = None
+
+    def invalidate(self, address: int):
+        '''Forget the compiled functions that were built from address'''
+        starts = self.owners[address]
+        if not starts:
+            return
+        for start in list(starts):
+            function = self.compiled[start]
+            self.compiled[start] = None
+            if function is None:
+                continue
+            self.discard(start)
+            for covered in function.addresses:
+                owners = self.owners[covered]
+                if owners is not None:
+                    owners.discard(start)
+                    if not owners:
+                        self.owners[covered] = None
+
+    def discard(self, start: int):
+        '''Hook for engines that keep extra state per compiled entry'''
+        pass
+
+    def install(self, start: int, addresses: set, body: list, name: str, params: str = ""):
+        '''Compile body into a function entered at start and register what it was built from'''
+        lines = ["def factory(vm, mem, dec, dirty, owners, invalidate):",
+                 f"    def {name}({params}):",
+                 "        acc = vm.accumulator",
+                 "        count = vm.instruction_count",
+                 *indent(body, 2),
+                 f"    return {name}"]
+        namespace = {}
+        exec(compile("\n".join(lines), f"<{name} {start:03d}>", "exec"), namespace)
+        function = namespace["factory"](self.vm, self.words, self.vm._decoded, self.vm.dirty, self.owners, self.invalidate)
+        function.addresses = addresses
+        function.length = len(addresses)
+
+        self.compiled[start] = function
+        for address in addresses:
+            if self.owners[address] is None:
+                self.owners[address] = set()
+            self.owners[address].add(start)
+        return function
+
+    def decoded(self, address: int):
+        '''Return (opcode, operand) for address, or None if the word cannot execute'''
+        vm = self.vm
+        opcode, handler, operand = vm._decoded[address] or vm.decode(address)
+        if handler in (vm._invalid_address, vm._invalid_opcode):
+            return None
+        return opcode, operand
+
+class BlockCompiler(CodeCache):
+    '''Block-compiled execution engine for a VM.
+
+    The loaded program is split into basic blocks that start at branch targets
+    (or wherever execution enters) and end after a BRANCH, BRANCHNEG,
+    BRANCHZERO or HALT. Each block is generated as Python source, compiled once,
+    and run as straight-line code over a local accumulator. A block returns the
+    address of the next block, or None when it reaches HALT.
+    '''
+    def flush(self):
+        super().flush()
+        self.leaders = self.find_leaders()
+
+    def find_leaders(self) -> set:
+        '''Collect every address a branch in the loaded program can jump to'''
+        leaders = set()
+        for address in range(len(self.words)):
+            opcode, operand = divmod(abs(self.words[address]), OPERAND_BASE)
+            if opcode in BRANCH_OPS and operand < MEMORY_LENGTH:
+                leaders.add(operand)
+        return leaders
+
+    def run(self, limit: int) -> bool:
+        '''Run until HALT or until instruction_count reaches limit. Returns True if the limit stopped it'''
+        vm = self.vm
+        if vm._words is not self.words:
+            self.flush()
+        blocks = self.compiled
+        pc = vm.program_counter
+        while pc is not None and not vm.halted:
+            block = blocks[pc] or self.compile(pc)
+            if block is None:
+                # Nothing compilable here: let the interpreter execute (and report) it
+                if vm.instruction_count >= limit:
+                    return True
+                vm.process_next_step()
+                pc = vm.program_counter
+            elif vm.instruction_count + block.length > limit:
+                # Not enough budget left for the whole block; finish instruction by instruction
+                return vm._interpret(limit)
+            else:
+                pc = block()
+        return False
+
+    def compile(self, start: int):
+        '''Compile the basic block starting at start, or return None if it is empty'''
+        instructions = []
+        address = start
+        while address < MEMORY_LENGTH:
+            if address != start and address in self.leaders:
+                break
+            decoded = self.decoded(address)
+            if decoded is None:
+                break  # The interpreter raises the right error for this word
+            instructions.append((address, *decoded))
+            address += 1
+            if decoded[0] in TERMINATORS:
+                break
+
+        if not instructions:
+            return None
+
+        end = start + len(instructions)
+        body = []
+        for address, opcode, operand in instructions:
+            body += self.emit(address, opcode, operand, start, end)
+        if instructions[-1][1] not in TERMINATORS:
+            body += exit_to(end, end - start)
+        return self.install(start, set(range(start, end)), body, "block")
+
+    @staticmethod
+    def emit(address: int, opcode: int, operand: int, start: int, end: int) -> list:
+        '''Generate the source lines for one instruction of the block spanning start to end'''
+        following = address + 1
+        executed = following - start
+        if opcode == BRANCH:
+            return exit_to(operand, executed)
+        if opcode in (BRANCHNEG, BRANCHZERO):
+            condition = "acc < 0" if opcode == BRANCHNEG else "acc == 0"
+            return [f"target = {operand} if {condition} else {following}",
+                    "vm.accumulator = acc",
+                    "vm.program_counter = target",
+                    f"vm.instruction_count = count + {executed}",
+                    "return target"]
+        if opcode == HALT:
+            return sync(address, executed - 1) + ["return None"]
+
+        lines = emit_operation(address, opcode, operand, executed)
+        # A write to a later instruction of this same block must take effect now
+        if opcode in (STORE, READ) and following <= operand < end:
+            lines += exit_to(following, executed)
+        return lines
+
+class TraceCompiler(CodeCache):
+    '''Tracing JIT engine for a VM.
+
+    Instructions are interpreted while counting how often each backward branch
+    target is reached. Once a loop head gets hot, one iteration of the loop is
+    recorded as it executes and compiled into a function that keeps spinning
+    the loop. Every BRANCHNEG/BRANCHZERO on the recorded path becomes a guard;
+    when a guard fails the function hands control back to the interpreter at
+    the address the branch really goes to.
+    '''
+    hot_threshold = 50
+    max_trace_length = MEMORY_LENGTH
+
+    def flush(self):
+        super().flush()
+        self.counters = [0] * MEMORY_LENGTH
+
+    def discard(self, start: int):
+        self.counters[start] = 0
+
+    def run(self, limit: int) -> bool:
+        '''Run until HALT or until instruction_count reaches limit. Returns True if the limit stopped it'''
+        vm = self.vm
+        if vm._words is not self.words:
+            self.flush()
+        decoded = vm._decoded
+        traces = self.compiled
+        counters = self.counters
+        while not vm.halted:
+            pc = vm.program_counter
+            trace = traces[pc]
+            if trace is not None:
+                if trace(limit) is None and not vm.halted:
+                    # Too little budget left for another iteration; finish instruction by instruction
+                    return vm._interpret(limit)
+                continue
+            opcode, handler, operand = decoded[pc] or vm.decode(pc)
+            if opcode == HALT:
+                return False
+            if vm.instruction_count >= limit:
+                return True
+            vm.program_counter = pc + 1
+            vm.instruction_count += 1
+            handler(operand)
+            if opcode in BRANCH_OPS and operand <= pc and vm.program_counter == operand:
+                counters[operand] += 1
+                if counters[operand] >= self.hot_threshold:
+                    self.record(operand, limit)
+        return False
+
+    def record(self, head: int, limit: int):
+        '''Execute one iteration of the loop at head, then compile the path it took'''
+        vm = self.vm
+        path = []
+        recorded = []
+        while len(path) < self.max_trace_length and not vm.halted and vm.instruction_count < limit:
+            pc = vm.program_counter
+            decoded = self.decoded(pc)
+            if decoded is None or decoded[0] == HALT:
+                break
+            recorded.append((pc, vm._words[pc]))
+            vm.process_next_step()
+            path.append((pc, *decoded, vm.program_counter))
+            if vm.program_counter == head:
+                # A path that rewrote its own earlier instructions would compile the stale ones
+                if all(vm._words[address] == word for address, word in recorded):
+                    self.compile(head, path)
+                    return
+                break
+        # The loop did not close on a simple path; back off before trying again
+        self.counters[head] = -self.hot_threshold * 10
+
+    def compile(self, head: int, path: list):
+        '''Compile a recorded loop iteration into a trace function entered at head'''
+        addresses = {address for address, _, _, _ in path}
+        body = []
+        for executed, (address, opcode, operand, taken) in enumerate(path, 1):
+            following = address + 1
+            if opcode == BRANCH:
+                continue
+            if opcode in (BRANCHNEG, BRANCHZERO):
+                condition = "acc < 0" if opcode == BRANCHNEG else "acc == 0"
+                if operand == following:
+                    continue
+                if taken == operand:
+                    body += [f"if not {condition}:", *indent(exit_to(following, executed))]
+                else:
+                    body += [f"if {condition}:", *indent(exit_to(operand, executed))]
+                continue
+            body += emit_operation(address, opcode, operand, executed)
+            # Writing over the loop's own code ends the trace so it can be re-recorded
+            if opcode in (STORE, READ) and operand in addresses:
+                body += exit_to(following, executed)
+        # Each pass runs the whole path, so only start one that fits in the budget
+        body = [f"while count + {len(path)} <= limit and not vm.halted:",
+                *indent(body),
+                f"    count += {len(path)}",
+                *sync(head, 0)]
+        return self.install(head, addresses, body, "trace", "limit")
@@ -2,16 +2,41 @@
 MEMORY_LENGTH = 250
 WORD_LENGTH = 6
 
+# Where assembled programs are cached, keyed by a hash of their source
+ASSEMBLER_CACHE_DIR = ".uvsim_cache"
+
+# Reverse execution: steps kept for undo, and steps between full memory checkpoints
+JOURNAL_SIZE = 100_000
+JOURNAL_CHECKPOINT_INTERVAL = 1_000
+
 # GUI Configuration
 WINDOW_WIDTH = 800
 WINDOW_HEIGHT = 700
 
+# Worker-to-GUI events: buffered writes kept between frames, milliseconds per frame, console lines kept
+OUTPUT_BUFFER_SIZE = 10_000
+EVENT_FRAME_MS = 33
+CONSOLE_MAX_LINES = 5_000
+
+# Live view while a program runs: instructions between published states, and screen refreshes per second
+LIVE_PUBLISH_INTERVAL = 10_000
+LIVE_REFRESH_HZ = 30
+
+# Instructions a run may execute between checks for pause and stop requests
+CONTROL_CHECK_INTERVAL = 10_000
+
+# Run each tab's VM in its own worker process instead of a thread of the GUI process
+USE_WORKER_PROCESSES = False
+# Seconds a worker gets to honour Stop before its process is killed
+WORKER_STOP_TIMEOUT = 2.0
+
 # Theme Configuration
 THEME_FILE = "theme.json"
 DEFAULT_APPEARANCE_MODE = "dark"
 
 # File types for open/save dialogs
 FILE_TYPES = [("Text files", "*.txt"), ("All files", "*.*")]
+OPEN_FILE_TYPES = [("Programs", "*.txt *.uvi"), ("Text files", "*.txt"), ("Program images", "*.uvi"), ("All files", "*.*")]
 
 # Error messages
 ERR_INVALID_WORD = "Invalid word. Please enter a {}-digit word between -{} and {}."
@@ -19,6 +44,10 @@ ERR_PROGRAM_TOO_LARGE = "Program is larger than available memory."
 ERR_NO_HALT_INSTRUCTION = "Program does not contain HALT instruction."
 ERR_INVALID_MEMORY_ADDRESS = "Invalid memory address: {}"
 ERR_INVALID_OPCODE = "Invalid opcode: {}"
+ERR_STEP_LIMIT = "Program did not halt within {} instructions."
+ERR_INFINITE_LOOP = "Program is stuck in an infinite loop at address {:03d} (repeats every {} instructions)."
+ERR_NO_HISTORY = "No earlier step is recorded."
+ERR_STOPPED = "Program stopped."
 ERR_EXECUTION = "An error occurred while running the program: {}"
 ERR_FILE_LOAD = "Failed to load file: {}"
 ERR_FILE_SAVE = "Failed to save file: {}"
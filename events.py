@@ -0,0 +1,57 @@
+import threading
+from collections import deque, namedtuple
+from config import *
+
+# Events a VM worker posts for the Tk thread
+OutputEvent = namedtuple("OutputEvent", ["text"])
+InputRequestEvent = namedtuple("InputRequestEvent", ["prompt"])
+StateChangedEvent = namedtuple("StateChangedEvent", [])
+HaltedEvent = namedtuple("HaltedEvent", [])
+ErrorEvent = namedtuple("ErrorEvent", ["message"])
+
+class EventChannel:
+    '''Thread-safe, bounded hand-off of events from a VM worker thread to the Tk thread.
+
+    Workers post() from any thread; the Tk thread calls drain() once per frame
+    and handles the whole batch. Consecutive outputs are merged into a single
+    OutputEvent, keeping at most output_capacity writes (older ones are dropped
+    and counted), and only the last StateChangedEvent of a batch survives, since
+    each one means "redraw from the VM's current state".
+    '''
+    def __init__(self, output_capacity: int = OUTPUT_BUFFER_SIZE):
+        self.output_capacity = output_capacity
+        self.lock = threading.Lock()
+        self.events = []
+        self.chunks = deque()
+        self.dropped = 0
+
+    def post(self, event):
+        with self.lock:
+            if isinstance(event, OutputEvent):
+                if len(self.chunks) >= self.output_capacity:
+                    self.chunks.popleft()
+                    self.dropped += 1
+                self.chunks.append(event.text)
+                return
+            self._seal_output()
+            self.events.append(event)
+
+    def _seal_output(self):
+        '''Turn the writes buffered since the last non-output event into one OutputEvent'''
+        if not self.chunks:
+            return
+        text = "".join(self.chunks)
+        if self.dropped:
+            text = f"[{self.dropped} earlier outputs dropped]\n" + text
+        self.events.append(OutputEvent(text))
+        self.chunks.clear()
+        self.dropped = 0
+
+    def drain(self) -> list:
+        '''Remove and return every pending event, in order, with state changes coalesced'''
+        with self.lock:
+            self._seal_output()
+            events, self.events = self.events, []
+        last_state = max((i for i, event in enumerate(events) if isinstance(event, StateChangedEvent)), default=None)
+        return [event for i, event in enumerate(events)
+                if not isinstance(event, StateChangedEvent) or i == last_state]
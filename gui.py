@@ -1,11 +1,14 @@
 import customtkinter as ctk
-from tkinter import filedialog, messagebox, ttk, WORD
-import sys
+from tkinter import filedialog, messagebox, WORD
 import threading
-from queue import Queue
-from vm import VM, ProgramLoader
+from queue import Empty, Queue
+from vm import VM, ProgramLoader, RunControl
 from program_edit_window import ProgramEditor
+from memory_view import MemoryView
+from worker import ProcessWorker
 from text_redirector import TextRedirector, InputRedirector
+from events import (EventChannel, OutputEvent, InputRequestEvent, StateChangedEvent,
+                    HaltedEvent, ErrorEvent)
 from config import *
 
 class VMHeader(ctk.CTkLabel):
@@ -20,14 +23,13 @@ class VMApp(ctk.CTkFrame):
         self.is_running = False
 
         self.vm = VM()
+        self.vm.publish_interval = LIVE_PUBLISH_INTERVAL
+        self.vm.control = RunControl()
+        self.last_sample = None
         self.pl = ProgramLoader()
         self.program_editor = ProgramEditor(self)
         self.waiting_for_input = False
 
-        # Create a StringVar to hold the console output
-        self.console_output = ctk.StringVar()
-        self.console_output.trace_add('write', self.update_console)
-
         # Configure the main grid layout
         self.grid_columnconfigure(0, weight=3)
         self.grid_columnconfigure(1, weight=2)
@@ -44,11 +46,14 @@ class VMApp(ctk.CTkFrame):
         self.populate_right_frame()
 
         self.setup_input_redirection()
-        # Set VM input and output functions
-        self.vm.set_io_functions(self.input_redirector.readline, self.output_redirector.write)
+        # Optionally run programs in a worker process that shares this VM's memory
+        self.worker = ProcessWorker(self.vm, self.events) if USE_WORKER_PROCESSES else None
+        # Connect the VM's READs and WRITEs to this tab's console
+        self.vm.set_io(self.input_redirector, self.output_redirector)
         # Update the GUI to reflect the initial state of the VM
         self.update_screen()
         self.update_memory_tree()
+        self.after(EVENT_FRAME_MS, self.process_events)
     
     def populate_left_frame(self):
         # Configure the grid layout for the left frame
@@ -58,32 +63,9 @@ class VMApp(ctk.CTkFrame):
         # Add the "Memory" header
         VMHeader(self.left_frame, text="Memory").grid(row=0, column=0, sticky="w", padx=10, pady=(10, 0))
 
-        style = ttk.Style()
-        style.configure("Custom.Treeview", font=('Helvetica', 20), rowheight=30)
-        style.configure("Custom.Treeview.Heading", font=('Helvetica', 22, 'bold'))
-
-        # Create a frame to hold the Treeview and Scrollbar
-        tree_frame = ctk.CTkFrame(self.left_frame)
-        tree_frame.grid(row=1, column=0, sticky="nsew", padx=10, pady=10)
-        tree_frame.grid_rowconfigure(0, weight=1)
-        tree_frame.grid_columnconfigure(0, weight=1)
-
-        # Create the Treeview
-        self.memory_tree = ttk.Treeview(tree_frame, columns=("Address", "Value"),
-            show="headings", style="Custom.Treeview")
-        
-        self.memory_tree.heading("Address", text="Address")
-        self.memory_tree.heading("Value", text="Value")
-        self.memory_tree.column("Address", anchor="center", width=180)
-        self.memory_tree.column("Value", anchor="center", width=180)
-        self.memory_tree.grid(row=0, column=0, sticky="nsew")
-
-        # Create the Scrollbar
-        scrollbar = ctk.CTkScrollbar(tree_frame, command=self.memory_tree.yview)
-        scrollbar.grid(row=0, column=1, sticky="ns")
-
-        # Configure the Treeview to use the Scrollbar
-        self.memory_tree.configure(yscrollcommand=scrollbar.set)
+        # Create the memory display; it only materializes the rows that are on screen
+        self.memory_view = MemoryView(self.left_frame, self.vm)
+        self.memory_view.grid(row=1, column=0, sticky="nsew", padx=10, pady=10)
 
         # Create a frame for the control buttons
         button_frame = ctk.CTkFrame(self.left_frame)
@@ -95,6 +77,11 @@ class VMApp(ctk.CTkFrame):
         ctk.CTkButton(button_frame, text="Run Program", command=self.run_from_start).grid(row=0, column=1, padx=5, pady=5)
         ctk.CTkButton(button_frame, text="Program Editor", command=self.open_program_editor).grid(row=0, column=2, padx=5, pady=5)
         ctk.CTkButton(button_frame, text="Save File", command=self.save_file).grid(row=1, column=0, padx=5, pady=5)
+        ctk.CTkButton(button_frame, text="Step Back", command=self.step_back).grid(row=1, column=1, padx=5, pady=5)
+        ctk.CTkButton(button_frame, text="Step Forward", command=self.step_forward).grid(row=1, column=2, padx=5, pady=5)
+        self.pause_button = ctk.CTkButton(button_frame, text="Pause", command=self.toggle_pause)
+        self.pause_button.grid(row=2, column=1, padx=5, pady=5)
+        ctk.CTkButton(button_frame, text="Stop", command=self.stop).grid(row=2, column=2, padx=5, pady=5)
 
     def populate_right_frame(self):
         # Configure the grid layout for the right frame
@@ -109,6 +96,13 @@ class VMApp(ctk.CTkFrame):
         self.accumulator_label.pack(anchor="w")
         self.pc_label = ctk.CTkLabel(status_frame, text=f"Program Counter: {self.vm.program_counter}")
         self.pc_label.pack(anchor="w")
+        self.speed_label = ctk.CTkLabel(status_frame, text="Instructions/s: -")
+        self.speed_label.pack(anchor="w")
+        self.live_view = ctk.BooleanVar(value=True)
+        ctk.CTkSwitch(status_frame, text="Live view", variable=self.live_view).pack(anchor="w", pady=(5, 0))
+        # Off by default: recording every instruction slows full runs several times over
+        self.record_history = ctk.BooleanVar(value=False)
+        ctk.CTkSwitch(status_frame, text="Record history", variable=self.record_history).pack(anchor="w", pady=(5, 0))
 
         # Add the "Console" header
         VMHeader(self.right_frame, text="Console").grid(row=1, column=0, sticky="w", padx=10, pady=(5, 0))
@@ -133,8 +127,11 @@ class VMApp(ctk.CTkFrame):
 
             # Add a newline
             self.console_text.insert("end", "\n")
-            # Pass the input to the input queue
-            self.input_queue.put(command)
+            # Pass the input to the program
+            if self.worker is not None:
+                self.worker.send_input(command)
+            else:
+                self.input_queue.put(command)
             # Reset waiting_for_input flag
             self.waiting_for_input = False
         else:
@@ -142,7 +139,7 @@ class VMApp(ctk.CTkFrame):
             self.console_text.insert("end", "\n")
 
     def select_file(self):
-        file_path = filedialog.askopenfilename(filetypes=FILE_TYPES)
+        file_path = filedialog.askopenfilename(filetypes=OPEN_FILE_TYPES)
         if file_path == () or file_path == "":             
             return  # User cancelled file selection
         try:
@@ -173,18 +170,9 @@ class VMApp(ctk.CTkFrame):
         self.console_text.see("end")
 
     def update_memory_tree(self):
-        # Populate the memory display with current VM memory contents
-        if len(self.memory_tree.get_children()) == 0:
-            for i, value in enumerate(self.vm.memory):
-                address = f"{i:03d}"
-                self.memory_tree.insert("", "end", values=(address, value))
-                self.style_memory_tree()
-        
-        # Update any differences between memory tree and vm memory
-        else:
-            for i, item in enumerate(self.memory_tree.get_children()):
-                self.memory_tree.item(item, values=(f"{i:03d}", self.vm.memory[i]))
-                
+        # Repaint only the words the VM wrote since the last update
+        self.memory_view.refresh(self.vm.take_dirty())
+
     def update_screen(self):
         # Update the accumulator and program counter labels
         self.accumulator_label.configure(text=f"Accumulator: {self.vm.accumulator}")
@@ -193,53 +181,168 @@ class VMApp(ctk.CTkFrame):
         # Ensure the console is scrolled to the bottom
         self.console_text.see("end")
 
-    def style_memory_tree(self):
-        # Apply alternating row colors to the memory display
-        self.memory_tree.tag_configure('evenrow', background='lightgrey')
-        for index, row in enumerate(self.memory_tree.get_children()):
-            if index % 2 == 0:
-                self.memory_tree.item(row, tags=('evenrow',))
+    def append_console(self, text):
+        # Add program output to the console, keeping at most CONSOLE_MAX_LINES lines
+        self.console_text.insert("end", text)
+        lines = int(self.console_text.index("end-1c").split(".")[0])
+        if lines > CONSOLE_MAX_LINES:
+            self.console_text.delete("1.0", f"{lines - CONSOLE_MAX_LINES + 1}.0")
+        self.console_text.see("end")
+
+    def process_events(self):
+        # Runs on the Tk thread every frame: apply everything the VM worker posted since the last one
+        if not self.winfo_exists():
+            return
+        if self.worker is not None:
+            self.worker.poll()
+            self.is_running = self.worker.running
+        for event in self.events.drain():
+            if isinstance(event, OutputEvent):
+                self.append_console(event.text)
+            elif isinstance(event, InputRequestEvent):
+                self.waiting_for_input = True
+                self.display_prompt()
+            elif isinstance(event, ErrorEvent):
+                self.append_console(f"Error: {event.message}\n")
+            elif isinstance(event, (StateChangedEvent, HaltedEvent)):
+                self.update_screen()
+                self.update_memory_tree()
+        self.after(EVENT_FRAME_MS, self.process_events)
+
+    def sample_live_state(self):
+        # While a program runs, redraw from the state the VM last published, LIVE_REFRESH_HZ times a second
+        if not self.is_running or not self.winfo_exists():
+            return
+        published = self.vm.published if self.worker is None else self.worker.published()
+        if self.live_view.get() and published is not None:
+            pc, accumulator, count, timestamp = published
+            self.accumulator_label.configure(text=f"Accumulator: {accumulator}")
+            self.pc_label.configure(text=f"Program Counter: {pc}")
+            if self.last_sample is not None and timestamp > self.last_sample[1]:
+                rate = (count - self.last_sample[0]) / (timestamp - self.last_sample[1])
+                self.speed_label.configure(text=f"Instructions/s: {rate:,.0f}")
+            self.last_sample = (count, timestamp)
+            if self.worker is None:
+                self.update_memory_tree()
+            else:
+                # The worker's writes are not tracked here, but only the visible rows are redrawn
+                self.memory_view.refresh()
+        self.after(1000 // LIVE_REFRESH_HZ, self.sample_live_state)
 
     def clear_all_fields(self):
         # Reset the VM state
         self.vm.program_counter = 0
         self.vm.accumulator = 0
+        self.vm.instruction_count = 0
+        self.vm.disable_journal()
         # Clear the console
         self.console_text.delete("1.0", "end")
         # Update the GUI to reflect the changes
         self.update_screen()
         self.update_memory_tree()
 
-    def check_for_memory_update(self):
-        # Check to see if memory has been changed. If so, updates the memory tree
-        last_opcode = self.vm.get_opcode(self.vm.program_counter - 1)
-
-        # If previous action was load or store, then the tree needs to be udpated
-        if last_opcode == "010" or last_opcode == "021":
-            self.update_memory_tree()
-
     def run_from_start(self):
+        if self.is_running:
+            return
+
         def run_program():
-            self.is_running = True
-            # Redirect stdout to this tab's console
-            original_stdout = sys.stdout
-            original_stdin = sys.stdin
-            sys.stdout = self.output_redirector
-            sys.stdin = self.input_redirector
-            
-            self.clear_all_fields()
             try:
                 self.vm.run()
+                self.events.post(HaltedEvent())
             except Exception as e:
-                self.console_text.insert(ctk.END, f"Error: {str(e)}\n")
+                self.events.post(ErrorEvent(str(e)))
             finally:
                 self.is_running = False
-                sys.stdout = original_stdout
-                sys.stdin = original_stdin
-                self.update_screen()
-                self.update_memory_tree()
+                self.events.post(StateChangedEvent())
+
+        self.clear_all_fields()
+        self.drain_input()
+        if self.record_history.get():
+            self.vm.enable_journal()
+        self.is_running = True
+        self.vm.control.reset()
+        self.pause_button.configure(text="Pause")
+        self.vm.published = None
+        self.last_sample = None
+        if self.worker is not None:
+            self.worker.run()
+        else:
+            threading.Thread(target=run_program, daemon=True).start()
+        self.sample_live_state()
+
+    def drain_input(self):
+        # Drop input and stop sentinels left over from an earlier run
+        while True:
+            try:
+                self.input_queue.get_nowait()
+            except Empty:
+                return
+
+    def toggle_pause(self):
+        # Pause takes effect at the VM's next control check, within CONTROL_CHECK_INTERVAL instructions
+        if not self.is_running:
+            return
+        control = self.vm.control
+        if control.paused:
+            control.resume()
+            if self.worker is not None:
+                self.worker.resume()
+            self.pause_button.configure(text="Pause")
+        else:
+            control.pause()
+            if self.worker is not None:
+                self.worker.pause()
+            self.pause_button.configure(text="Resume")
+
+    def stop(self):
+        # Ask the running program to stop; a READ waiting for input is released too
+        if not self.is_running:
+            return
+        self.vm.control.stop()
+        self.pause_button.configure(text="Pause")
+        if self.worker is not None:
+            self.worker.stop()
+        else:
+            # Always release a READ, even one whose input request has not reached this thread yet
+            self.waiting_for_input = False
+            self.input_queue.put(None)
+
+    def step_back(self):
+        # Undo the last executed instruction using the VM's journal
+        if self.is_running:
+            return
+        if not self.vm.step_back():
+            messagebox.showinfo("Step Back", ERR_NO_HISTORY)
+        self.update_screen()
+        self.update_memory_tree()
 
-        threading.Thread(target=run_program, daemon=True).start()
+    def step_forward(self):
+        # Redo or execute one instruction; a READ waits for console input, so step off the Tk thread
+        if self.is_running:
+            return
+
+        def step():
+            try:
+                if not self.vm.step_forward():
+                    self.output_redirector.write("HALT.\n")
+                    self.events.post(HaltedEvent())
+            except Exception as e:
+                self.events.post(ErrorEvent(str(e)))
+            finally:
+                self.is_running = False
+                self.events.post(StateChangedEvent())
+
+        # Stepping is always recorded, so Step Back can undo it
+        if self.vm.journal is None:
+            self.vm.enable_journal()
+        self.drain_input()
+        self.is_running = True
+        threading.Thread(target=step, daemon=True).start()
+
+    def destroy(self):
+        if self.worker is not None:
+            self.worker.close()
+        super().destroy()
 
     def open_program_editor(self):
         # Open the program editor window
@@ -247,10 +350,6 @@ class VMApp(ctk.CTkFrame):
         
     def setup_input_redirection(self):
         self.input_queue = Queue()
-        self.input_redirector = InputRedirector(self.input_queue, self)
-        self.output_redirector = TextRedirector(self.console_output, self, "stdout")
-
-    def update_console(self, *args):
-        self.console_text.insert(ctk.END, self.console_output.get())
-        self.console_text.see(ctk.END)
-        self.console_output.set('')
\ No newline at end of file
+        self.events = EventChannel()
+        self.input_redirector = InputRedirector(self.input_queue, self.events)
+        self.output_redirector = TextRedirector(self.events, "stdout")
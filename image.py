@@ -0,0 +1,94 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+from config import *
+from vm import VMError, InvalidWordError, OPERAND_BASE, WORD_MODULUS, WORD_TYPECODE, HALT
+
+# Layout: HEADER, then word_count little-endian int64 words.
+# HEADER holds the magic, format version, the word length the words are
+# encoded for, word_count and the SHA-256 of the word bytes.
+IMAGE_MAGIC = b"UVIM"
+IMAGE_VERSION = 1
+IMAGE_SUFFIX = ".uvi"
+HEADER = struct.Struct("<4sHHI32s")
+
+class ImageFormatError(VMError):
+    """Raised when a binary program image is malformed or corrupted."""
+    pass
+
+def is_image(filepath: str) -> bool:
+    with open(filepath, "rb") as f:
+        return f.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC
+
+def encode_image(words, word_length: int = WORD_LENGTH) -> bytes:
+    '''Pack words (ints) into image bytes'''
+    packed = array(WORD_TYPECODE, words)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    data = packed.tobytes()
+    return HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, word_length, len(packed), hashlib.sha256(data).digest()) + data
+
+def write_image(filepath: str, words, word_length: int = WORD_LENGTH):
+    '''Write an image file atomically: readers see either the old file or the complete new one'''
+    temporary = f"{filepath}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(encode_image(words, word_length))
+    os.replace(temporary, filepath)
+
+def image_words(buffer) -> memoryview:
+    '''Validate image bytes and return their words as a memoryview of int64, without copying'''
+    view = memoryview(buffer)
+    if len(view) < HEADER.size:
+        raise ImageFormatError("Image is shorter than its header")
+    magic, version, word_length, count, digest = HEADER.unpack_from(view)
+    if magic != IMAGE_MAGIC:
+        raise ImageFormatError("Not a program image")
+    if version != IMAGE_VERSION:
+        raise ImageFormatError(f"Unsupported image version: {version}")
+    if word_length != WORD_LENGTH:
+        raise ImageFormatError(f"Image holds {word_length}-digit words, expected {WORD_LENGTH}")
+    if count > MEMORY_LENGTH:
+        raise MemoryError(ERR_PROGRAM_TOO_LARGE)
+    data = view[HEADER.size:HEADER.size + count * 8]
+    if len(data) != count * 8 or hashlib.sha256(data).digest() != digest:
+        raise ImageFormatError("Image is truncated or corrupted")
+    words = data.cast(WORD_TYPECODE)
+    check_words(words if sys.byteorder == "little" else _swapped(words))
+    return words
+
+def check_words(words):
+    '''Apply the text loader's rules to image words: every word in range, and a HALT somewhere'''
+    has_halt = False
+    for word in words:
+        if not -WORD_MODULUS < word < WORD_MODULUS:
+            raise InvalidWordError(f"Invalid instruction: {word}")
+        if abs(word) // OPERAND_BASE == HALT:
+            has_halt = True
+    if not has_halt:
+        raise VMError(ERR_NO_HALT_INSTRUCTION)
+
+def _swapped(words) -> array:
+    swapped = array(WORD_TYPECODE, words)
+    swapped.byteswap()
+    return swapped
+
+def image_array(buffer) -> array:
+    '''Validate image bytes and return a copy of their words as native ints'''
+    words = image_words(buffer)
+    return array(WORD_TYPECODE, words) if sys.byteorder == "little" else _swapped(words)
+
+def load_image_buffer(vm, buffer):
+    '''Copy the words of an image held in any buffer straight into vm's memory'''
+    if sys.byteorder == "big":
+        vm.load_image_words(image_array(buffer))
+        return
+    with image_words(buffer) as words:
+        vm.load_image_words(words)
+
+def load_image(vm, filepath: str):
+    '''Map an image file and copy its words straight into vm's memory'''
+    with open(filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        load_image_buffer(vm, mapped)
@@ -0,0 +1,113 @@
+from collections import deque
+from config import *
+
+class StepJournal:
+    '''Bounded undo journal of executed VM steps.
+
+    Each step is stored as a delta holding only what it changed: the program
+    counter, accumulator and overflow count before and after, plus at most one
+    memory cell (address, old word, new word). Deltas live in a ring buffer of
+    size steps, so old history is dropped instead of growing without bound.
+    Every checkpoint_interval steps a full copy of memory is kept as well, which
+    lets goto() reach any retained step by replaying at most one interval.
+
+    Steps are numbered by the VM's instruction_count before they execute.
+    '''
+    def __init__(self, size: int = JOURNAL_SIZE, checkpoint_interval: int = JOURNAL_CHECKPOINT_INTERVAL):
+        self.size = size
+        self.checkpoint_interval = checkpoint_interval
+        self.deltas = deque(maxlen=size)
+        self.checkpoints = deque()
+        self.clear()
+
+    def clear(self, step: int = 0):
+        '''Forget all history and start recording at step'''
+        self.deltas.clear()
+        self.checkpoints.clear()
+        self.base = step
+
+    @property
+    def end(self) -> int:
+        '''Step number just after the last recorded delta'''
+        return self.base + len(self.deltas)
+
+    def covers(self, step: int) -> bool:
+        return self.base <= step <= self.end
+
+    def before_step(self, vm):
+        '''Prepare to record the step about to run from vm's current state'''
+        step = vm.instruction_count
+        if not self.covers(step):
+            self.clear(step)
+        # Executing from the middle of the history replaces everything after it
+        while self.end > step:
+            self.deltas.pop()
+        while self.checkpoints and self.checkpoints[-1][0] > step:
+            self.checkpoints.pop()
+        if step % self.checkpoint_interval == 0 and not (self.checkpoints and self.checkpoints[-1][0] == step):
+            self.checkpoints.append((step, vm.program_counter, vm.accumulator, vm.overflow_count, vm._words.tobytes()))
+
+    def record(self, before: tuple, address, old_word, vm):
+        '''Append the delta for a step that started in state before = (pc, acc, overflows)'''
+        new_word = None if address is None else vm._words[address]
+        if len(self.deltas) == self.size:
+            self.base += 1
+            while self.checkpoints and self.checkpoints[0][0] < self.base:
+                self.checkpoints.popleft()
+        self.deltas.append((*before, address, old_word, new_word,
+                            vm.program_counter, vm.accumulator, vm.overflow_count))
+
+    def undo(self, vm) -> bool:
+        '''Reverse the step that led to vm's current state'''
+        step = vm.instruction_count
+        if not (self.base < step <= self.end):
+            return False
+        pc, accumulator, overflows, address, old_word = self.deltas[step - 1 - self.base][:5]
+        if address is not None:
+            vm.write_word(address, old_word)
+        vm.program_counter, vm.accumulator, vm.overflow_count = pc, accumulator, overflows
+        vm.instruction_count = step - 1
+        return True
+
+    def redo(self, vm) -> bool:
+        '''Re-apply the recorded step that follows vm's current state, without executing it'''
+        step = vm.instruction_count
+        if not (self.base <= step < self.end):
+            return False
+        address, _, new_word, pc, accumulator, overflows = self.deltas[step - self.base][3:]
+        if address is not None:
+            vm.write_word(address, new_word)
+        vm.program_counter, vm.accumulator, vm.overflow_count = pc, accumulator, overflows
+        vm.instruction_count = step + 1
+        return True
+
+    def restore_checkpoint(self, vm, step: int) -> bool:
+        '''Load the latest checkpoint at or before step into vm'''
+        for checkpoint in reversed(self.checkpoints):
+            if checkpoint[0] <= step:
+                checkpoint_step, pc, accumulator, overflows, data = checkpoint
+                vm._load_words(data)
+                vm.program_counter, vm.accumulator, vm.overflow_count = pc, accumulator, overflows
+                vm.instruction_count = checkpoint_step
+                return True
+        return False
+
+    def goto(self, vm, step: int) -> bool:
+        '''Move vm to the state before step, replaying at most one checkpoint interval of deltas'''
+        if not self.covers(step):
+            return False
+        current = vm.instruction_count
+        nearest = max((c[0] for c in self.checkpoints if c[0] <= step), default=None)
+        backwards = current - step if self.covers(current) and current >= step else None
+        forwards = step - current if self.covers(current) and current <= step else None
+
+        candidates = [cost for cost in (backwards, forwards) if cost is not None]
+        if nearest is not None and (not candidates or step - nearest < min(candidates)):
+            self.restore_checkpoint(vm, step)
+        elif backwards is None and forwards is None:
+            return False
+        while vm.instruction_count > step:
+            self.undo(vm)
+        while vm.instruction_count < step:
+            self.redo(vm)
+        return True
@@ -0,0 +1,146 @@
+import numpy as np
+from config import *
+from vm import (VM, OPERAND_BASE, WORD_MODULUS, InvalidWordError, InvalidMemoryAddressError,
+                InvalidOpcodeError, InputExhaustedError, READ, WRITE, LOAD, STORE, ADD, SUBTRACT,
+                DIVIDE, MULTIPLY, BRANCH, BRANCHNEG, BRANCHZERO, HALT)
+
+class LockstepBatch:
+    '''Runs one loaded program against many input vectors at once.
+
+    Every lane is an independent VM state: pc and acc are vectors, memory is an
+    N x MEMORY_LENGTH matrix. Each step fetches every live lane's instruction,
+    groups the lanes by opcode and applies that opcode to the whole group with
+    vectorized NumPy operations, so lanes whose control flow diverges still
+    advance together. Per lane, the results match VM.process_next_step,
+    including accumulator truncation and divide-by-zero errors.
+
+    READ takes the next value from the lane's input vector and WRITE appends
+    the word to the lane's outputs. Errors stop only the lane that raised them
+    and are recorded in errors[lane] as the exception the VM would raise.
+    '''
+    def __init__(self, vm: VM, inputs: list):
+        lanes = len(inputs)
+        for vector in inputs:
+            for word in vector:
+                if not vm.is_valid_word(str(word)):
+                    raise InvalidWordError(ERR_INVALID_WORD.format(WORD_LENGTH, "9" * WORD_LENGTH, "9" * WORD_LENGTH))
+
+        self.memory = np.tile(np.frombuffer(vm._words, dtype=np.int64), (lanes, 1))
+        self.pc = np.full(lanes, vm.program_counter, dtype=np.int64)
+        self.acc = np.full(lanes, vm.accumulator, dtype=np.int64)
+        self.steps = np.zeros(lanes, dtype=np.int64)
+        self.overflows = np.zeros(lanes, dtype=np.int64)
+        self.done = np.zeros(lanes, dtype=bool)
+        self.halted = np.zeros(lanes, dtype=bool)
+        self.errors = [None] * lanes
+        self.outputs = [[] for _ in range(lanes)]
+
+        width = max((len(vector) for vector in inputs), default=0)
+        self.inputs = np.zeros((lanes, width), dtype=np.int64)
+        self.input_counts = np.array([len(vector) for vector in inputs], dtype=np.int64)
+        for lane, vector in enumerate(inputs):
+            self.inputs[lane, :len(vector)] = vector
+        self.input_cursor = np.zeros(lanes, dtype=np.int64)
+
+    def fail(self, lanes, error_class, message):
+        self.done[lanes] = True
+        for lane in lanes.tolist():
+            self.errors[lane] = error_class(message(lane) if callable(message) else message)
+
+    def truncate(self, lanes):
+        acc = self.acc[lanes]
+        overflow = np.abs(acc) >= WORD_MODULUS
+        if overflow.any():
+            self.overflows[lanes[overflow]] += 1
+            acc[overflow] = np.sign(acc[overflow]) * (np.abs(acc[overflow]) % WORD_MODULUS)
+            self.acc[lanes] = acc
+
+    def step(self) -> bool:
+        '''Advance every live lane by one instruction. Returns False once all lanes have stopped'''
+        live = np.flatnonzero(~self.done)
+        if live.size == 0:
+            return False
+
+        outside = self.pc[live] >= MEMORY_LENGTH
+        if outside.any():
+            self.fail(live[outside], IndexError, "Program counter ran past the end of memory")
+            live = live[~outside]
+
+        words = np.abs(self.memory[live, self.pc[live]])
+        opcodes = words // OPERAND_BASE
+        operands = words % OPERAND_BASE
+
+        bad_address = (operands >= MEMORY_LENGTH) & (opcodes != HALT)
+        if bad_address.any():
+            lanes = live[bad_address]
+            bad_operands = dict(zip(lanes.tolist(), operands[bad_address].tolist()))
+            self.fail(lanes, InvalidMemoryAddressError, lambda lane: ERR_INVALID_MEMORY_ADDRESS.format(bad_operands[lane]))
+            live, opcodes, operands = live[~bad_address], opcodes[~bad_address], operands[~bad_address]
+
+        halting = opcodes == HALT
+        if halting.any():
+            lanes = live[halting]
+            self.done[lanes] = True
+            self.halted[lanes] = True
+            self.pc[lanes] += 1
+            live, opcodes, operands = live[~halting], opcodes[~halting], operands[~halting]
+
+        self.pc[live] += 1
+        self.steps[live] += 1
+        for opcode in np.unique(opcodes).tolist():
+            group = opcodes == opcode
+            self.execute(opcode, live[group], operands[group])
+        return True
+
+    def execute(self, opcode: int, lanes, operands):
+        if opcode == READ:
+            cursor = self.input_cursor[lanes]
+            exhausted = cursor >= self.input_counts[lanes]
+            if exhausted.any():
+                self.fail(lanes[exhausted], InputExhaustedError, "No input left for READ")
+                lanes, operands, cursor = lanes[~exhausted], operands[~exhausted], cursor[~exhausted]
+            self.memory[lanes, operands] = self.inputs[lanes, cursor]
+            self.input_cursor[lanes] += 1
+        elif opcode == WRITE:
+            for lane, word in zip(lanes.tolist(), self.memory[lanes, operands].tolist()):
+                self.outputs[lane].append(word)
+        elif opcode == LOAD:
+            self.acc[lanes] = self.memory[lanes, operands]
+        elif opcode == STORE:
+            self.memory[lanes, operands] = self.acc[lanes]
+        elif opcode == ADD:
+            self.acc[lanes] += self.memory[lanes, operands]
+            self.truncate(lanes)
+        elif opcode == SUBTRACT:
+            self.acc[lanes] -= self.memory[lanes, operands]
+            self.truncate(lanes)
+        elif opcode == MULTIPLY:
+            self.acc[lanes] *= self.memory[lanes, operands]
+            self.truncate(lanes)
+        elif opcode == DIVIDE:
+            divisors = self.memory[lanes, operands]
+            by_zero = divisors == 0
+            if by_zero.any():
+                self.fail(lanes[by_zero], ZeroDivisionError, "Cannot divide by zero")
+                lanes, divisors = lanes[~by_zero], divisors[~by_zero]
+            acc = self.acc[lanes]
+            # Exact division rounding toward zero, like truncating_divide
+            self.acc[lanes] = np.sign(acc) * np.sign(divisors) * (np.abs(acc) // np.abs(divisors))
+        elif opcode == BRANCH:
+            self.pc[lanes] = operands
+        elif opcode == BRANCHNEG:
+            taken = self.acc[lanes] < 0
+            self.pc[lanes[taken]] = operands[taken]
+        elif opcode == BRANCHZERO:
+            taken = self.acc[lanes] == 0
+            self.pc[lanes[taken]] = operands[taken]
+        else:
+            self.fail(lanes, InvalidOpcodeError, ERR_INVALID_OPCODE.format(f"{opcode:03d}"))
+
+    def run(self, max_steps: int = None):
+        '''Step until every lane halts or fails, or until max_steps batch steps have run'''
+        count = 0
+        while self.step():
+            count += 1
+            if max_steps is not None and count >= max_steps:
+                break
@@ -18,16 +18,10 @@ class CustomTabview(ctk.CTkTabview):
         self.set(name)
         return new_tab
 
-    def set(self, name):
-        current_name = self.get()
-        if current_name in self.tab_apps and self.tab_apps[current_name].is_running:
-            return  # Prevent tab change if current program is running
-        super().set(name)
-    
     def close_tab(self, name):
         if name in self.tab_apps:
-            if self.tab_apps[name].is_running:
-                return  # Prevent closing if the program is running
+            # A running program is stopped rather than keeping the tab open
+            self.tab_apps[name].stop()
             if len(self.tab_apps) == 1:
                 exit(0)
             self.tab_apps[name].destroy()  # Destroy the VMApp instance
@@ -0,0 +1,92 @@
+import customtkinter as ctk
+from tkinter import ttk
+
+ROW_HEIGHT = 30
+VISIBLE_ROWS = 12
+WHEEL_ROWS = 3
+
+class MemoryView(ctk.CTkFrame):
+    '''Scrollable Address/Value table over a VM's memory that only materializes visible rows.
+
+    The Treeview holds one item per row on screen, however large memory is.
+    Scrolling moves a window over memory and rewrites the values of those items,
+    so building and refreshing the view costs the same for 250 words or 250,000.
+    Each item gets its alternating-row tag once, when it is created.
+    '''
+    def __init__(self, master, vm, **kwargs):
+        super().__init__(master, **kwargs)
+        self.vm = vm
+        self.first = 0
+        self.items = []
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        style = ttk.Style()
+        style.configure("Custom.Treeview", font=('Helvetica', 20), rowheight=ROW_HEIGHT)
+        style.configure("Custom.Treeview.Heading", font=('Helvetica', 22, 'bold'))
+
+        self.tree = ttk.Treeview(self, columns=("Address", "Value"), show="headings",
+                                 style="Custom.Treeview", height=VISIBLE_ROWS)
+        self.tree.heading("Address", text="Address")
+        self.tree.heading("Value", text="Value")
+        self.tree.column("Address", anchor="center", width=180)
+        self.tree.column("Value", anchor="center", width=180)
+        self.tree.tag_configure('evenrow', background='lightgrey')
+        self.tree.grid(row=0, column=0, sticky="nsew")
+
+        # The scrollbar drives the window over memory instead of the Treeview itself
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.yview)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll_rows(-WHEEL_ROWS))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_rows(WHEEL_ROWS))
+        self.set_row_count(VISIBLE_ROWS)
+
+    def set_row_count(self, rows: int):
+        '''Create or delete items so exactly rows of memory are materialized'''
+        rows = max(1, min(rows, len(self.vm.memory)))
+        while len(self.items) < rows:
+            tags = ('evenrow',) if len(self.items) % 2 == 0 else ()
+            self.items.append(self.tree.insert("", "end", tags=tags))
+        while len(self.items) > rows:
+            self.tree.delete(self.items.pop())
+        self.scroll_to(self.first)
+
+    def on_resize(self, event):
+        # One row's worth of height goes to the heading
+        rows = event.height // ROW_HEIGHT - 1
+        if rows != len(self.items):
+            self.set_row_count(rows)
+
+    def on_mousewheel(self, event):
+        self.scroll_rows(-WHEEL_ROWS if event.delta > 0 else WHEEL_ROWS)
+        return "break"
+
+    def yview(self, *args):
+        # Same protocol as a Treeview's yview: ("moveto", fraction) or ("scroll", n, "units"/"pages")
+        if args[0] == "moveto":
+            self.scroll_to(round(float(args[1]) * len(self.vm.memory)))
+        elif args[0] == "scroll":
+            self.scroll_rows(int(args[1]) * (len(self.items) if args[2] == "pages" else 1))
+
+    def scroll_rows(self, rows: int):
+        self.scroll_to(self.first + rows)
+
+    def scroll_to(self, first: int):
+        '''Show memory starting at address first, clamped so the window stays full'''
+        length = len(self.vm.memory)
+        self.first = max(0, min(first, length - len(self.items)))
+        self.scrollbar.set(self.first / length, (self.first + len(self.items)) / length)
+        self.refresh()
+
+    def refresh(self, addresses=None):
+        '''Repaint the given addresses, or every visible row, if they are on screen'''
+        memory = self.vm.memory
+        last = self.first + len(self.items)
+        if addresses is None:
+            addresses = range(self.first, last)
+        for address in addresses:
+            if self.first <= address < last:
+                self.tree.item(self.items[address - self.first], values=(f"{address:03d}", memory[address]))
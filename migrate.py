@@ -0,0 +1,99 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from validator import LEGACY_WORD_LENGTH, convert_legacy_word
+
+# 6-digit form of every legacy 4-digit word, built once so conversion is a
+# dictionary lookup per word; invalid digits are simply missing from the table
+LEGACY_TABLE = {digits: convert_legacy_word("+" + digits)[1:] for digits in (f"{n:04d}" for n in range(10**LEGACY_WORD_LENGTH))}
+
+CONVERTED = "converted"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+def conversion_record(path: str, status: str, message: str = None, words: int = 0) -> dict:
+    return {"program": path, "status": status, "message": message, "words": words}
+
+def convert_file(path: str, destination: str = None) -> dict:
+    '''Convert one legacy 4-digit program to 6 digits, writing it atomically to
+    destination (path itself by default).
+
+    The format is decided once from the first word: files already in the 6-digit
+    format are skipped, and a legacy file containing any other kind of word is
+    left untouched and reported as failed.
+    '''
+    destination = destination or path
+    try:
+        with open(path, "r") as f:
+            lines = f.read().splitlines()
+    except (OSError, UnicodeDecodeError) as e:
+        return conversion_record(path, FAILED, str(e))
+    first = next((line.strip() for line in lines if line.strip()), "")
+    if len(first) != LEGACY_WORD_LENGTH + 1:
+        return conversion_record(path, SKIPPED, "Not a legacy 4-digit program")
+
+    table = LEGACY_TABLE
+    converted = []
+    words = 0
+    for number, line in enumerate(lines, 1):
+        code = line.strip()
+        if not code:
+            converted.append("")
+            continue
+        digits = table.get(code[1:]) if code[0] in "+-" else None
+        if digits is None:
+            return conversion_record(path, FAILED, f"Line {number}: Invalid instruction: {code}")
+        converted.append(code[0] + digits)
+        words += 1
+
+    # Write then rename, so an interrupted migration never leaves a half-written program
+    temporary = f"{destination}.{os.getpid()}.tmp"
+    try:
+        directory = os.path.dirname(destination)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(temporary, "w") as f:
+            f.write("\n".join(converted) + "\n")
+        os.replace(temporary, destination)
+    except OSError as e:
+        # One unwritable output must not abort the rest of the tree
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        return conversion_record(path, FAILED, str(e))
+    return conversion_record(path, CONVERTED, words=words)
+
+def find_legacy_programs(directory: str, out_dir: str = None) -> list:
+    '''(source, destination) pairs for every .txt file under directory, mirroring
+    the tree into out_dir when one is given'''
+    pairs = []
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if name.endswith(".txt"):
+                path = os.path.join(root, name)
+                destination = os.path.join(out_dir, os.path.relpath(path, directory)) if out_dir else path
+                pairs.append((path, destination))
+    return sorted(pairs)
+
+def convert_chunk(pairs: list) -> list:
+    '''Worker entry point: convert a chunk of (source, destination) pairs'''
+    return [convert_file(path, destination) for path, destination in pairs]
+
+def convert_tree(directory: str, out_dir: str = None, jobs: int = 1, chunk_size: int = 64):
+    '''Convert every legacy program under directory, yielding one record per file as it finishes.
+
+    Files are converted in place unless out_dir is given. With jobs > 1 chunks of
+    chunk_size files are spread over a pool of worker processes, as in batch.run_corpus.
+    '''
+    pairs = find_legacy_programs(directory, out_dir)
+    chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+
+    if jobs <= 1:
+        for chunk in chunks:
+            yield from convert_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(convert_chunk, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            yield from future.result()
@@ -1,5 +1,7 @@
 import customtkinter as ctk
 from tkinter import messagebox
+from assembler import assemble_cached
+from vm import format_word
 
 class ProgramEditor:
     def __init__(self, parent_app):
@@ -43,6 +45,9 @@ class ProgramEditor:
         process_button = ctk.CTkButton(main_frame, text="Process", command=self.process_text)
         process_button.pack(pady=5)
 
+        assemble_button = ctk.CTkButton(main_frame, text="Assemble", command=self.assemble_text)
+        assemble_button.pack(pady=5)
+
         self.program_edit_window.attributes('-topmost', True)
          
     def process_text(self):
@@ -54,6 +59,16 @@ class ProgramEditor:
         except Exception as e:
             messagebox.showerror("Error", str(e), parent=self.program_edit_window)
         
+    def assemble_text(self):
+        # Replace mnemonic source (LOAD x, loop: BRANCHNEG end, x: DATA 5) with the BasicML words it assembles to
+        try:
+            words = assemble_cached(self.get_file_content())
+        except Exception as e:
+            messagebox.showerror("Error", str(e), parent=self.program_edit_window)
+            return
+        self.text_area.delete("1.0", "end")
+        self.text_area.insert("end", "\n".join(format_word(word) for word in words) + "\n")
+        
     def on_close(self):
         self.program_edit_window.destroy()
         self.parent_app.clear_all_fields()
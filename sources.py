@@ -0,0 +1,137 @@
+import io
+import mmap
+import os
+import tarfile
+import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from image import IMAGE_MAGIC, IMAGE_SUFFIX
+from assembler import ASSEMBLY_SUFFIX
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+PROGRAM_SUFFIXES = (".txt", IMAGE_SUFFIX, ASSEMBLY_SUFFIX)
+MAX_OPEN_ARCHIVES = 8
+
+# Archives stay open between loads, so a batch worker reads each central
+# directory once rather than once per member. A forked child must never use
+# its parent's archives: they share one file offset, so the cache is dropped
+# in every child.
+_open_archives = OrderedDict()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_open_archives.clear)
+
+def is_archive(path) -> bool:
+    return str(path).lower().endswith(ARCHIVE_SUFFIXES) and os.path.isfile(path)
+
+def split_member(path: str):
+    '''Split a path such as "class.zip/alice.txt" into ("class.zip", "alice.txt").
+    Returns (None, path) for anything that is not inside an archive.'''
+    if os.path.exists(path):
+        return None, path
+    normalized = path.replace(os.sep, "/")
+    index = 0
+    while True:
+        index = normalized.find("/", index + 1)
+        if index == -1:
+            return None, path
+        if is_archive(normalized[:index]):
+            return normalized[:index], normalized[index + 1:]
+
+def program_name(path: str) -> str:
+    '''How batch results name a program: the member path inside its archive
+    (such as "alice/program.txt"), or the file name for a file on disk'''
+    archive_path, name = split_member(path)
+    return os.path.basename(path) if archive_path is None else name
+
+def _open(archive_path: str):
+    if zipfile.is_zipfile(archive_path):
+        return zipfile.ZipFile(archive_path)
+    return tarfile.open(archive_path)
+
+def open_archive(archive_path: str):
+    archive = _open_archives.pop(archive_path, None)
+    if archive is None:
+        archive = _open(archive_path)
+        if len(_open_archives) >= MAX_OPEN_ARCHIVES:
+            _open_archives.popitem(last=False)[1].close()
+    _open_archives[archive_path] = archive
+    return archive
+
+def archive_members(archive_path: str, suffixes=PROGRAM_SUFFIXES) -> list:
+    '''Paths of every program in an archive, in the "archive/member" form load accepts.
+    The archive is closed again, so nothing stays open for worker processes to inherit.'''
+    with _open(archive_path) as archive:
+        if isinstance(archive, zipfile.ZipFile):
+            names = [info.filename for info in archive.infolist() if not info.is_dir()]
+        else:
+            names = [member.name for member in archive.getmembers() if member.isfile()]
+    return sorted(f"{archive_path}/{name}" for name in names if name.endswith(suffixes))
+
+def open_member(archive_path: str, name: str):
+    '''Open one archive member as a binary stream, without extracting it to disk'''
+    archive = open_archive(archive_path)
+    try:
+        if isinstance(archive, zipfile.ZipFile):
+            return archive.open(name)
+        stream = archive.extractfile(name)
+    except KeyError:
+        raise FileNotFoundError(f"No member {name} in {archive_path}") from None
+    if stream is None:
+        raise FileNotFoundError(f"Member {name} of {archive_path} is not a file")
+    return stream
+
+@contextmanager
+def program_source(source):
+    '''Yield a program from any supported source, either as a buffer holding a
+    binary image or as an iterable of text lines that is read lazily.
+
+    source may be a path (including "archive.zip/member" paths into .zip and
+    .tar archives), an open text or binary file such as sys.stdin, bytes or a
+    memoryview, or any other iterable of text lines.
+    '''
+    if isinstance(source, (str, os.PathLike)):
+        archive_path, name = split_member(os.fspath(source))
+        if archive_path is not None:
+            with open_member(archive_path, name) as stream:
+                with _binary_stream(stream) as program:
+                    yield program
+            return
+        with open(source, "rb") as stream:
+            if stream.peek(len(IMAGE_MAGIC)).startswith(IMAGE_MAGIC):
+                # Image files are mapped rather than read
+                with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    yield mapped
+            else:
+                with _binary_stream(stream) as program:
+                    yield program
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        if bytes(source[:len(IMAGE_MAGIC)]) == IMAGE_MAGIC:
+            yield source
+        else:
+            yield io.TextIOWrapper(io.BytesIO(source))
+    elif isinstance(source, io.TextIOBase):
+        yield source
+    elif hasattr(source, "read"):
+        with _binary_stream(source) as program:
+            yield program
+    else:
+        yield source
+
+@contextmanager
+def _binary_stream(stream):
+    head = stream.peek(len(IMAGE_MAGIC))[:len(IMAGE_MAGIC)] if hasattr(stream, "peek") else None
+    if head is None:
+        data = stream.read()
+        if isinstance(data, str):
+            yield io.StringIO(data)
+        else:
+            yield data if data.startswith(IMAGE_MAGIC) else io.TextIOWrapper(io.BytesIO(data))
+    elif head == IMAGE_MAGIC:
+        yield stream.read()
+    else:
+        text = io.TextIOWrapper(stream)
+        try:
+            yield text
+        finally:
+            # Leave closing the stream to its owner
+            text.detach()
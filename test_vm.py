@@ -1,8 +1,21 @@
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import patch, mock_open
 from io import StringIO
-from vm import VM, ProgramLoader
+from vm import VM, VMError, InvalidWordError, VMPool, RunControl, ExecutionStoppedError, InputExhaustedError, ProgramLoader, InvalidMemoryAddressError, StepLimitExceededError, InfiniteLoopError, truncating_divide
 from gui import VMApp
+from text_redirector import TextRedirector
+from worker import ProcessWorker
+from assembler import assemble, assemble_cached, AssemblyError
+from validator import parse_program, INVALID_DIGIT, INVALID_LENGTH, INVALID_SIGN, MISSING_HALT, PROGRAM_TOO_LARGE
+from image import ImageFormatError, encode_image, image_words, load_image
+from channels import ConsoleChannel, FileChannel, ListChannel, NullChannel, ScriptedInput
+from events import EventChannel, OutputEvent, InputRequestEvent, StateChangedEvent, HaltedEvent, ErrorEvent
 import customtkinter as ctk
 from config import *
 
@@ -170,6 +183,961 @@ class TestTruncateAccumulator(unittest.TestCase):
         vm.truncate_accumulator()
         assert vm.accumulator == -913443
 
+class TestIntegerMemory(unittest.TestCase):
+    # Words are stored as integers but read back as signed strings
+    def test_string_view(self):
+        vm = VM()
+        vm.memory[3] = "-000042"
+        assert vm._words[3] == -42
+        assert vm.memory[3] == "-000042"
+        assert vm.memory[4] == "+000000"
+
+    # Ops work on the integer backend directly
+    def test_store_then_load(self):
+        vm = VM()
+        vm.accumulator = -7
+        vm.store_op(10)
+        vm.accumulator = 0
+        vm.load_op(10)
+        assert vm.accumulator == -7
+        assert vm.memory[10] == "-000007"
+
+    def test_memory_length(self):
+        vm = VM()
+        assert len(vm.memory) == MEMORY_LENGTH
+        assert list(vm.memory)[:2] == ["+000000", "+000000"]
+
+class TestDirtyTracking(unittest.TestCase):
+    # STOREs and READs report exactly the words they touched; loads, resets and
+    # restores replace all of memory, so they report every address without a scan
+    @patch("vm.input", return_value="7")
+    def test_writes_are_tracked(self, mock_input):
+        vm = VM()
+        vm.memory = ["+020003", "+043000"]
+        assert vm.take_dirty() == list(range(MEMORY_LENGTH))
+        vm.accumulator = 5
+        vm.store_op(20)
+        vm.read_op(4)
+        assert vm.take_dirty() == [4, 20]
+        assert vm.take_dirty() == []
+        vm.restore(vm.snapshot())
+        assert vm.take_dirty() == list(range(MEMORY_LENGTH))
+        vm.reset()
+        assert not vm.dirty
+        assert len(vm.take_dirty()) == MEMORY_LENGTH
+
+    # Compiled STOREs report their writes too
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_compiled_stores(self, mock_stdout):
+        for engine in ("block", "trace"):
+            vm = VM(engine=engine)
+            vm.memory = COUNTDOWN_PROGRAM
+            vm.take_dirty()
+            vm.run()
+            assert vm.take_dirty() == [10, 12]
+
+class TestDecodedProgram(unittest.TestCase):
+    # A STORE over an already-decoded instruction takes effect on the next pass
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_self_modifying_program(self, mock_stdout):
+        vm = VM()
+        vm.memory = [
+            "+020006",  # 0: LOAD 6
+            "+021003",  # 1: STORE 3 (overwrite the branch below with HALT)
+            "+011007",  # 2: WRITE 7
+            "+040002",  # 3: BRANCH 2
+            "+043000",
+            "+000000",
+            "+043000",  # 6: HALT word used as data
+            "+000005"
+        ]
+        vm.run()
+        assert mock_stdout.getvalue().count("+000005") == 1
+        assert vm.program_counter == 4
+
+    # Out of range operands only fail when the word is executed
+    def test_invalid_operand_at_decode(self):
+        vm = VM()
+        vm.memory = ["+040001", "+043000", "+020999"]
+        vm.run()
+        vm.program_counter = 2
+        with self.assertRaises(InvalidMemoryAddressError):
+            vm.process_next_step()
+        assert vm.program_counter == 2
+
+COUNTDOWN_PROGRAM = [
+    "+020010",  # 0: LOAD 10
+    "+031011",  # 1: SUBTRACT 11
+    "+021010",  # 2: STORE 10
+    "+020012",  # 3: LOAD 12
+    "+030013",  # 4: ADD 13
+    "+021012",  # 5: STORE 12
+    "+020010",  # 6: LOAD 10
+    "+042009",  # 7: BRANCHZERO 9
+    "+040000",  # 8: BRANCH 0
+    "+043000",  # 9: HALT
+    "+000500",  # 10: counter
+    "+000001",
+    "+000000",  # 12: total
+    "+004000"
+]
+
+class TestBlockEngine(unittest.TestCase):
+    engine = "block"
+
+    def run_both(self, program):
+        results = []
+        for engine in ("interpreter", self.engine):
+            vm = VM(engine=engine)
+            vm.output_func = lambda *args: None
+            vm.memory = program
+            vm.run()
+            results.append((vm.program_counter, vm.accumulator, list(vm.memory), vm.instruction_count, vm.overflow_count))
+        return results
+
+    # Compiled blocks leave the VM in the same state as the interpreter
+    def test_matches_interpreter(self):
+        interpreted, compiled = self.run_both(COUNTDOWN_PROGRAM)
+        assert interpreted == compiled
+        assert compiled[2][12] == "+000000"  # 500 * 4000 wraps to zero
+
+    # A store into a compiled block forces just that block to be recompiled
+    def test_store_into_compiled_block(self):
+        program = [
+            "+020020",  # 0: LOAD 20
+            "+031021",  # 1: SUBTRACT 21
+            "+021020",  # 2: STORE 20
+            "+042006",  # 3: BRANCHZERO 6
+            "+040000",  # 4: BRANCH 0 (patched to BRANCH 5 below)
+            "+043000",  # 5: HALT
+            "+020022",  # 6: LOAD 22
+            "+021004",  # 7: STORE 4
+            "+020023",  # 8: LOAD 23
+            "+021020",  # 9: STORE 20
+            "+040000",  # 10: BRANCH 0
+        ] + ["+000000"] * 9 + ["+000003", "+000001", "+040005", "+000002"]
+        interpreted, compiled = self.run_both(program)
+        assert interpreted == compiled
+        assert compiled[0] == 6
+
+    # Loops that take a guard exit mid-trace still match the interpreter
+    def test_guard_exit(self):
+        program = [
+            "+020010",  # 0: LOAD 10
+            "+031011",  # 1: SUBTRACT 11
+            "+021010",  # 2: STORE 10
+            "+041006",  # 3: BRANCHNEG 6
+            "+011010",  # 4: WRITE 10
+            "+040000",  # 5: BRANCH 0
+            "+043000",  # 6: HALT
+            "+000000", "+000000", "+000000",
+            "+000200",  # 10: counter
+            "+000001"
+        ]
+        interpreted, compiled = self.run_both(program)
+        assert interpreted == compiled
+        assert compiled[1] == -1
+
+    # Every engine stops at exactly the same instruction when the budget runs out
+    def test_step_limit(self):
+        states = []
+        for engine in ("interpreter", self.engine):
+            vm = VM(engine=engine)
+            vm.memory = COUNTDOWN_PROGRAM
+            with self.assertRaises(StepLimitExceededError):
+                vm.run(max_steps=1234)
+            states.append((vm.program_counter, vm.accumulator, list(vm.memory), vm.instruction_count))
+        assert states[0] == states[1]
+        assert states[0][3] == 1234
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            VM(engine="turbo")
+
+class TestLoopDetection(unittest.TestCase):
+    # A loop that never changes memory repeats its state
+    def test_tight_loop(self):
+        vm = VM()
+        vm.memory = ["+020005", "+030006", "+040000", "+043000", "+000000", "+000001", "+000000"]
+        with self.assertRaises(InfiniteLoopError) as context:
+            vm.run(detect_loops=True)
+        assert context.exception.period == 3
+        # Address 0 first runs with accumulator 0 and later with 1, so the repeating state starts at 1
+        assert context.exception.entry_pc == 1
+
+    # The entry is the loop's first address, however late the repeat is noticed
+    def test_loop_entry(self):
+        vm = VM()
+        vm.memory = ["+020010", "+021011", "+031010", "+030012", "+040003", "+043000",
+                     "+000000", "+000000", "+000000", "+000000", "+000007", "+000000", "+000000"]
+        with self.assertRaises(InfiniteLoopError) as context:
+            vm.run(detect_loops=True)
+        assert (context.exception.entry_pc, context.exception.period) == (3, 2)
+
+    # Storing past the end of memory is reported as an invalid address, as without detection
+    def test_invalid_store_address(self):
+        vm = VM()
+        vm.memory = ["+021300", "+043000"]
+        with self.assertRaises(InvalidMemoryAddressError):
+            vm.run(detect_loops=True)
+
+    # A counter that keeps changing memory eventually wraps around and repeats
+    def test_wrapping_counter(self):
+        vm = VM()
+        vm.memory = ["+020005", "+030006", "+021005", "+040000", "+043000", "+000000", "+000100"]
+        with self.assertRaises(InfiniteLoopError) as context:
+            vm.run(detect_loops=True)
+        assert context.exception.period == 4 * 10**4
+
+    # Programs that halt are unaffected
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_halting_program(self, mock_stdout):
+        vm = VM()
+        vm.memory = COUNTDOWN_PROGRAM
+        vm.run(detect_loops=True)
+        assert vm.program_counter == 10
+
+    def test_step_limit(self):
+        vm = VM()
+        vm.max_steps = 10
+        vm.memory = ["+040000"]
+        with self.assertRaises(StepLimitExceededError):
+            vm.run()
+        assert vm.instruction_count == 10
+
+class TestTraceEngine(TestBlockEngine):
+    engine = "trace"
+
+    # Hot loops get compiled into a trace once the head crosses the threshold
+    def test_hot_loop_is_traced(self):
+        vm = VM(engine="trace")
+        vm.memory = COUNTDOWN_PROGRAM
+        vm.output_func = lambda *args: None
+        vm.run()
+        assert vm._engine.compiled[0] is not None
+
+    # A loop that walks an array by incrementing its own ADD operand must never reuse the stale ADD
+    def test_self_modifying_array_walk(self):
+        program = [
+            "+020030",  # 0: LOAD 30 (sum)
+            "+030040",  # 1: ADD 40, operand incremented every iteration
+            "+021030",  # 2: STORE 30
+            "+020001",  # 3: LOAD 1
+            "+030031",  # 4: ADD 31 (one)
+            "+021001",  # 5: STORE 1
+            "+020032",  # 6: LOAD 32 (count)
+            "+031031",  # 7: SUBTRACT 31
+            "+021032",  # 8: STORE 32
+            "+042011",  # 9: BRANCHZERO 11
+            "+040000",  # 10: BRANCH 0
+            "+043000",  # 11: HALT
+        ] + ["+000000"] * 18 + ["+000000", "+000001", "+000120"] + ["+000000"] * 7 + [f"+{i:06d}" for i in range(1, 121)]
+        interpreted, compiled = self.run_both(program)
+        assert interpreted == compiled
+        assert compiled[2][30] == f"+{sum(range(1, 121)):06d}"
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DIVIDE_PROGRAM = [
+    "+010020",  # 0: READ 20
+    "+010021",  # 1: READ 21
+    "+020020",  # 2: LOAD 20
+    "+032021",  # 3: DIVIDE 21
+    "+033020",  # 4: MULTIPLY 20
+    "+021022",  # 5: STORE 22
+    "+011022",  # 6: WRITE 22
+    "+041009",  # 7: BRANCHNEG 9
+    "+040000",  # 8: BRANCH 0
+    "+043000",  # 9: HALT
+]
+
+@unittest.skipUnless(numpy, "NumPy is not installed")
+class TestLockstepBatch(unittest.TestCase):
+    def run_vm(self, inputs):
+        vm = VM()
+        vm.memory = DIVIDE_PROGRAM
+        feed = iter(inputs)
+        outputs = []
+        vm.set_io_functions(lambda prompt: str(next(feed)), outputs.append)
+        try:
+            vm.run()
+            error = None
+        except StopIteration:
+            error = "InputExhaustedError"
+        except Exception as e:
+            error = type(e).__name__
+        return [int(line) for line in outputs if line.strip()[1:].isdigit()], vm.accumulator, error
+
+    # Every lane ends in the same state a separate VM.run() would reach
+    def test_matches_vm(self):
+        from lockstep import LockstepBatch
+        inputs = [
+            [999999, 1, -5, 2],
+            [7, 2, 9, 3, -999999, -7],
+            [50, 0],
+            [-30, 4],
+            [12]
+        ]
+        vm = VM()
+        vm.memory = DIVIDE_PROGRAM
+        batch = LockstepBatch(vm, inputs)
+        batch.run()
+        for lane, vector in enumerate(inputs):
+            outputs, accumulator, error = self.run_vm(vector)
+            assert batch.outputs[lane] == outputs
+            assert batch.acc[lane] == accumulator
+            assert type(batch.errors[lane]).__name__ == (error or "NoneType")
+
+class TestBatchRunner(unittest.TestCase):
+    # Each input vector gets its own result record
+    def test_run_corpus(self):
+        from batch import run_corpus
+        inputs = {"Test1.txt": [[3, 4], [5]]}
+        results = list(run_corpus(["test_files/Test1.txt", "test_files/TooLong.txt"], inputs))
+        assert [r["program"] for r in results] == ["Test1.txt", "Test1.txt", "TooLong.txt"]
+        assert results[0]["outputs"] == ["+000004"] and results[0]["halted"]
+        assert results[1]["error"] == "InputExhaustedError"
+        assert results[2]["error"] == "MemoryError"
+
+    # Worker processes produce the same records as an in-process run
+    def test_process_pool(self):
+        from batch import run_corpus
+        programs = ["test_files/Test3.txt", "test_files/Test4.txt", "test_files/FullProgram.txt"]
+        serial = sorted((r["program"], r["outputs"], r["instructions"]) for r in run_corpus(programs))
+        pooled = sorted((r["program"], r["outputs"], r["instructions"]) for r in run_corpus(programs, jobs=2, chunk_size=2))
+        assert serial == pooled
+
+class TestCliRun(unittest.TestCase):
+    # Output streams to stdout and the exit code tells how the run ended
+    @patch("sys.stdin", new_callable=lambda: StringIO("3\n4\n"))
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_run_program(self, mock_stdout, mock_stdin):
+        from cli import main, EXIT_OK
+        assert main(["run", "test_files/Test1.txt"]) == EXIT_OK
+        assert mock_stdout.getvalue() == "+000004\nHALT.\n"
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_json_and_exit_codes(self, mock_stdout):
+        from cli import main, EXIT_INPUT_EXHAUSTED, EXIT_LOAD_ERROR
+        with patch("sys.stdin", StringIO("")):
+            assert main(["run", "test_files/Test1.txt", "--json"]) == EXIT_INPUT_EXHAUSTED
+        assert json.loads(mock_stdout.getvalue())["error"] == "InputExhaustedError"
+        with patch("sys.stderr", new_callable=StringIO):
+            assert main(["run", "test_files/TooLong.txt"]) == EXIT_LOAD_ERROR
+
+    # Unopenable files and options that run() would silently ignore are usage errors
+    @patch("sys.stderr", new_callable=StringIO)
+    def test_usage_errors(self, mock_stderr):
+        from cli import main, EXIT_USAGE
+        with tempfile.TemporaryDirectory() as directory:
+            assert main(["run", "test_files/Test1.txt", "--input", os.path.join(directory, "missing.txt")]) == EXIT_USAGE
+            assert main(["run", "test_files/Test1.txt", "--input", "test_files/Test1.txt",
+                         "--trace", os.path.join(directory, "no", "such", "dir")]) == EXIT_USAGE
+            assert main(["run", "test_files/Test1.txt", "--detect-loops", "--trace", os.path.join(directory, "t.bin")]) == EXIT_USAGE
+            assert main(["run", "test_files/Test1.txt", "--detect-loops", "--engine", "block"]) == EXIT_USAGE
+        assert "Traceback" not in mock_stderr.getvalue()
+
+SUM_SOURCE = """
+        READ n          # count down from n, adding each value to total
+loop:   LOAD total
+        ADD n
+        STORE total
+        LOAD n
+        SUBTRACT one
+        STORE n
+        BRANCHZERO end
+        BRANCH loop
+end:    WRITE total
+        HALT
+n:      DATA 0
+one:    DATA 1
+total:  DATA 0
+"""
+
+class TestAssembler(unittest.TestCase):
+    # Labels resolve in both directions and the image runs as assembled
+    def test_assemble_and_run(self):
+        assembly = assemble(SUM_SOURCE)
+        assert assembly.symbols["loop"] == 1 and assembly.symbols["total"] == 13
+        assert assembly.to_text().splitlines()[:2] == ["+010011", "+020013"]
+        vm = VM()
+        ProgramLoader().load_words(vm, assembly.words)
+        output = ListChannel()
+        vm.set_io(ScriptedInput([4]), output)
+        vm.run()
+        assert output.outputs == ["+000010", "HALT."]
+
+    # Legacy output converts back to the same image
+    def test_four_digit_output(self):
+        assembly = assemble(SUM_SOURCE, word_length=4)
+        text = assembly.to_text(4)
+        assert text.splitlines()[0] == "+1011"
+        vm = VM()
+        ProgramLoader().load_string(vm, text)
+        assert list(vm._words[:len(assembly.words)]) == list(assembly.words)
+
+    # In the 4-digit format a DATA value starting with an opcode would reload as an instruction
+    def test_four_digit_data_clash(self):
+        with self.assertRaises(AssemblyError) as context:
+            assemble("HALT\nx: DATA 2005", word_length=4)
+        assert str(context.exception).startswith("Line 2:")
+        assert list(assemble("HALT\nx: DATA 2005").words) == [43000, 2005]
+
+    # .asm sources load through the assembler cache
+    def test_load_assembly(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sum.asm")
+            with open(path, "w") as f:
+                f.write(SUM_SOURCE)
+            cache_dir = os.path.join(directory, "cache")
+            with patch.object(assemble_cached, "__defaults__", (WORD_LENGTH, cache_dir)):
+                vm = VM()
+                ProgramLoader().load(vm, path)
+                assert list(vm._words[:len(assemble(SUM_SOURCE).words)]) == list(assemble(SUM_SOURCE).words)
+                assert len(os.listdir(cache_dir)) == 1
+                with patch("assembler.assemble") as mock_assemble:
+                    ProgramLoader().load(VM(), path)
+                    mock_assemble.assert_not_called()
+
+    def test_errors_report_line(self):
+        for source, message in (("LOAD x\nHALT", "Line 1: Undefined symbol: x"),
+                                ("a: HALT\na: HALT", "Line 2: Duplicate label: a"),
+                                ("\nJUMP 3", "Line 2: Unknown mnemonic: JUMP"),
+                                ("LOAD 250", "Line 1: Operand out of range: 250")):
+            with self.assertRaises(AssemblyError) as context:
+                assemble(source)
+            assert str(context.exception) == message
+
+    # Unchanged sources come straight from the cache
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            words = assemble_cached(SUM_SOURCE, cache_dir=cache_dir)
+            with patch("assembler.assemble") as mock_assemble:
+                assert assemble_cached(SUM_SOURCE, cache_dir=cache_dir) == words
+                mock_assemble.assert_not_called()
+            assert len(os.listdir(cache_dir)) == 1
+
+    # Damaged entries are assembled again, and a cache that cannot be written is skipped
+    def test_cache_failures(self):
+        expected = assemble(SUM_SOURCE).words
+        with tempfile.TemporaryDirectory() as cache_dir:
+            assemble_cached(SUM_SOURCE, cache_dir=cache_dir)
+            entry = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+            for damage in (lambda data: data[:-3], lambda data: data[:-8], lambda data: data[:-1] + b"\x01"):
+                with open(entry, "rb") as f:
+                    data = f.read()
+                with open(entry, "wb") as f:
+                    f.write(damage(data))
+                assert assemble_cached(SUM_SOURCE, cache_dir=cache_dir) == expected
+            blocker = os.path.join(cache_dir, "blocker")
+            with open(blocker, "w") as f:
+                f.write("a file where a directory is needed")
+            assert assemble_cached(SUM_SOURCE, cache_dir=os.path.join(blocker, "cache")) == expected
+            with patch("assembler.os.replace", side_effect=PermissionError("read-only")):
+                assert assemble_cached(SUM_SOURCE + "\n", cache_dir=cache_dir) == expected
+            assert len(os.listdir(cache_dir)) == 2
+
+class TestValidator(unittest.TestCase):
+    # Every bad word is reported with its position, not just the first one
+    def test_reports_all_diagnostics(self):
+        program = parse_program(["+020005\n", "  +02x005\n", "*020005\n", "+12\n", "+2005\n"])
+        assert [(d.line, d.column, d.code) for d in program.diagnostics] == [
+            (2, 6, INVALID_DIGIT), (3, 1, INVALID_SIGN), (4, 1, INVALID_LENGTH), (0, 0, MISSING_HALT)]
+        assert list(program.words) == [20005, 0, 0, 0, 20005]
+
+    # Legacy words are converted once, and the editor sees the converted text
+    def test_legacy_words(self):
+        program = parse_program(["+2007", "-0043", "+4300"], keep_text=True)
+        assert program.ok
+        assert list(program.words) == [20007, -43, 43000]
+        assert program.texts == ["+020007", "-000043", "+043000"]
+
+    def test_too_large(self):
+        program = parse_program(["+043000"] * (MEMORY_LENGTH + 2))
+        assert [d.code for d in program.diagnostics] == [PROGRAM_TOO_LARGE]
+        assert len(program.words) == MEMORY_LENGTH
+        with self.assertRaises(MemoryError):
+            program.raise_for_errors()
+
+    # load_string keeps blank lines as empty words and ignores a trailing newline
+    def test_load_string(self):
+        vm = VM()
+        ProgramLoader().load_string(vm, "+2007\n\n+043000\n" + "\n" * MEMORY_LENGTH)
+        assert vm.memory[0] == "+020007" and vm.memory[1] == "+000000" and vm.memory[2] == "+043000"
+
+    def test_cli_lint(self):
+        from cli import main, EXIT_OK, EXIT_LOAD_ERROR
+        with patch("sys.stdout", new_callable=StringIO) as stdout:
+            assert main(["lint", "test_files/Test1.txt"]) == EXIT_OK
+            assert main(["lint", "test_files/TooLong.txt"]) == EXIT_LOAD_ERROR
+        assert f"test_files/TooLong.txt:{MEMORY_LENGTH + 1}:1: {PROGRAM_TOO_LARGE}" in stdout.getvalue()
+
+class TestProgramSources(unittest.TestCase):
+    def setUp(self):
+        with open("test_files/Test1.txt", "rb") as f:
+            self.data = f.read()
+        self.expected = VM()
+        ProgramLoader().load(self.expected, "test_files/Test1.txt")
+
+    def assert_loads(self, source):
+        vm = VM()
+        ProgramLoader().load(vm, source)
+        assert list(vm.memory) == list(self.expected.memory)
+
+    # Lines, buffers and open files load the same as the path
+    def test_in_memory_sources(self):
+        from io import BytesIO
+        self.assert_loads(self.data.decode().splitlines())
+        self.assert_loads(self.data)
+        self.assert_loads(memoryview(self.data))
+        self.assert_loads(BytesIO(self.data))
+        self.assert_loads(StringIO(self.data.decode()))
+        self.assert_loads(encode_image(self.expected._words))
+
+    # Members load straight out of zip and tar archives, and batch runs whole archives
+    def test_archive_members(self):
+        import tarfile
+        import zipfile
+        from batch import find_programs, run_corpus
+        with tempfile.TemporaryDirectory() as directory:
+            zip_path = os.path.join(directory, "class.zip")
+            with zipfile.ZipFile(zip_path, "w") as archive:
+                archive.writestr("alice/Test1.txt", self.data)
+                archive.writestr("bob/Test1.txt", self.data)
+                archive.writestr("notes.md", "not a program")
+            tar_path = os.path.join(directory, "class.tar")
+            with tarfile.open(tar_path, "w") as archive:
+                archive.add("test_files/Test1.txt", arcname="Test1.txt")
+            self.assert_loads(zip_path + "/alice/Test1.txt")
+            self.assert_loads(tar_path + "/Test1.txt")
+            with self.assertRaises(FileNotFoundError):
+                ProgramLoader().load(VM(), zip_path + "/missing.txt")
+            assert find_programs(zip_path) == [zip_path + "/alice/Test1.txt", zip_path + "/bob/Test1.txt"]
+            # Students with same-named files are told apart and get their own inputs
+            results = list(run_corpus(find_programs(zip_path), {"alice/Test1.txt": [[3, 4]], "*": [[3, 9]]}))
+        assert [(r["program"], r["outputs"], r["error"]) for r in results] == [
+            ("alice/Test1.txt", ["+000004"], None), ("bob/Test1.txt", ["+000009"], None)]
+
+    # Worker processes must not share the parent's open archive: -j 1 and -j N agree
+    def test_parallel_archive_batch(self):
+        import tarfile
+        import zipfile
+        from batch import find_programs, run_corpus
+        programs = ["Test1.txt", "Test2.txt", "Test3.txt", "Test4.txt", "FullProgram.txt"]
+        with tempfile.TemporaryDirectory() as directory:
+            zip_path = os.path.join(directory, "class.zip")
+            tar_path = os.path.join(directory, "class.tar")
+            with zipfile.ZipFile(zip_path, "w") as zip_archive, tarfile.open(tar_path, "w") as tar_archive:
+                for index in range(60):
+                    name = programs[index % len(programs)]
+                    zip_archive.write(f"test_files/{name}", f"{index:03d}_{name}")
+                    tar_archive.add(f"test_files/{name}", arcname=f"{index:03d}_{name}")
+            for archive_path in (zip_path, tar_path):
+                # Warm this process's cache, as a grader's parent process might
+                ProgramLoader().load(VM(), find_programs(archive_path)[0])
+                serial, parallel = (
+                    sorted((list(run_corpus(find_programs(archive_path), {"*": [[3, 4, 5]]}, jobs, 4, 10_000))),
+                           key=lambda r: r["program"])
+                    for jobs in (1, 4))
+                strip = lambda records: [{k: v for k, v in r.items() if k != "wall_time"} for r in records]
+                assert strip(serial) == strip(parallel)
+
+class TestMigrate(unittest.TestCase):
+    # A legacy tree converts to exactly what the loader produces from the old files
+    def test_convert_tree(self):
+        from migrate import convert_tree, CONVERTED, SKIPPED, FAILED
+        with open("test_files/OldFormat.txt") as f:
+            old = f.read()
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "class", "alice"))
+            for name, text in (("class/alice/old.txt", old), ("class/new.txt", "+043000\n"), ("class/bad.txt", "+2007\n+04300\n")):
+                with open(os.path.join(directory, name), "w") as f:
+                    f.write(text)
+            out_dir = os.path.join(directory, "out")
+            records = {os.path.basename(r["program"]): r for r in convert_tree(os.path.join(directory, "class"), out_dir, jobs=2, chunk_size=1)}
+            assert records["old.txt"]["status"] == CONVERTED
+            assert records["new.txt"]["status"] == SKIPPED
+            assert records["bad.txt"]["status"] == FAILED and records["bad.txt"]["message"].startswith("Line 2")
+            assert not os.path.exists(os.path.join(out_dir, "bad.txt"))
+            with open(os.path.join(out_dir, "alice", "old.txt")) as f, open("test_files/NewFormat.txt") as expected:
+                assert f.read().split() == expected.read().split()
+
+    # A destination that cannot be written fails that file only, leaving no temporary behind
+    def test_unwritable_destination(self):
+        from migrate import convert_file, FAILED
+        with tempfile.TemporaryDirectory() as directory:
+            blocker = os.path.join(directory, "blocker")
+            with open(blocker, "w") as f:
+                f.write("a file where a directory is needed")
+            record = convert_file("test_files/OldFormat.txt", os.path.join(blocker, "old.txt"))
+            assert record["status"] == FAILED
+            destination = os.path.join(directory, "existing")
+            os.makedirs(destination)
+            with patch("migrate.os.replace", side_effect=PermissionError("read-only")):
+                assert convert_file("test_files/OldFormat.txt", destination)["status"] == FAILED
+            assert os.listdir(destination) == [] and sorted(os.listdir(directory)) == ["blocker", "existing"]
+
+class TestProgramImage(unittest.TestCase):
+    # A compiled image loads to exactly the memory the text loader produces
+    def test_compile_and_load(self):
+        text_vm = VM()
+        ProgramLoader().load(text_vm, "test_files/Test1.txt")
+        with tempfile.TemporaryDirectory() as directory:
+            image_path = ProgramLoader().compile_image("test_files/Test1.txt", os.path.join(directory, "Test1.uvi"))
+            vm = VM()
+            vm.memory[100] = "+000007"
+            ProgramLoader().load(vm, image_path)
+        assert list(vm.memory) == list(text_vm.memory)
+        assert 100 in vm.take_dirty()
+
+    # The editor shows an image as its 6-digit words
+    def test_force_load_image(self):
+        class Editor:
+            memory = None
+        editor = Editor()
+        ProgramLoader().force_load(encode_image([20005, -43000]), editor)
+        assert editor.memory == ["+020005", "-043000"]
+
+    # Corrupted, truncated or foreign files are rejected before memory is touched
+    def test_rejects_bad_images(self):
+        data = bytearray(encode_image([20005, 43000]))
+        assert list(image_words(data)) == [20005, 43000]
+        with self.assertRaises(ImageFormatError):
+            image_words(data[:-1])
+        data[-1] ^= 1
+        with self.assertRaises(ImageFormatError):
+            image_words(data)
+        with self.assertRaises(ImageFormatError):
+            image_words(b"+020005\n+043000\n" * 4)
+
+    # Images follow the text loader's rules for word length, word range and HALT
+    def test_rejects_invalid_words(self):
+        with self.assertRaises(ImageFormatError):
+            ProgramLoader().load(VM(), encode_image([20005, 43000], word_length=4))
+        with self.assertRaises(InvalidWordError):
+            ProgramLoader().load(VM(), encode_image([20005, 43000, 12345678]))
+        with self.assertRaises(VMError):
+            ProgramLoader().load(VM(), encode_image([20005, 11005]))
+
+    def test_cli_compile(self):
+        from cli import main, EXIT_OK
+        with tempfile.TemporaryDirectory() as directory, patch("sys.stdout", new_callable=StringIO):
+            assert main(["compile", "test_files/Test1.txt", "-o", directory]) == EXIT_OK
+            vm = VM()
+            load_image(vm, os.path.join(directory, "Test1.uvi"))
+        assert vm.memory[0] != "+000000"
+
+class TestIntegerArithmetic(unittest.TestCase):
+    # Division truncates toward zero without going through floats
+    def test_truncating_division(self):
+        vm = VM()
+        vm.accumulator = -7
+        vm.memory[0] = "+000002"
+        vm.divide_op(0)
+        assert vm.accumulator == -3
+        assert truncating_divide(10**17 + 1, 3) == 33333333333333333
+
+    # Overflowing results wrap and are counted
+    def test_overflow_counter(self):
+        vm = VM()
+        vm.accumulator = 999999
+        vm.memory[0] = "+000002"
+        vm.add_op(0)
+        assert vm.accumulator == 1
+        vm.accumulator = -999999
+        vm.multiply_op(0)
+        assert vm.accumulator == -999998
+        vm.subtract_op(0)
+        assert vm.accumulator == 0
+        assert vm.overflow_count == 3
+
+class TestVMPool(unittest.TestCase):
+    # Released VMs come back reset to their power-on state
+    def test_reuse(self):
+        pool = VMPool()
+        with pool.borrow() as vm:
+            vm.memory = COUNTDOWN_PROGRAM
+            vm.accumulator = 12
+            vm.program_counter = 7
+            first = vm
+        vm = pool.acquire()
+        assert vm is first
+        assert (vm.accumulator, vm.program_counter, vm.instruction_count) == (0, 0, 0)
+        assert vm.memory[0] == "+000000"
+
+    # A compiled engine picks up the next program loaded into a reused VM
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_reuse_block_engine(self, mock_stdout):
+        pool = VMPool(engine="block")
+        with pool.borrow() as vm:
+            vm.memory = COUNTDOWN_PROGRAM
+            vm.run()
+        with pool.borrow() as vm:
+            vm.memory = ["+020003", "+030003", "+043000", "+000021"]
+            vm.run()
+            assert vm.accumulator == 42
+
+class TestSnapshotFork(unittest.TestCase):
+    # Forks share the snapshot's memory until they write to it
+    def test_copy_on_write(self):
+        vm = VM()
+        vm.memory = COUNTDOWN_PROGRAM
+        snapshot = vm.snapshot()
+        first = VM.fork(snapshot)
+        second = VM.fork(snapshot)
+        assert first._words is snapshot.words and second._words is snapshot.words
+
+        first.memory[10] = "+000002"
+        assert first._words is not snapshot.words
+        assert second.memory[10] == "+000500"
+        assert snapshot.words[10] == 500
+
+    # Each fork runs independently from the same starting image
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_forks_run_independently(self, mock_stdout):
+        vm = VM()
+        vm.memory = COUNTDOWN_PROGRAM
+        snapshot = pickle.loads(pickle.dumps(vm.snapshot()))
+        results = []
+        for engine in ("interpreter", "block", "trace"):
+            fork = VM.fork(snapshot, engine=engine)
+            fork.run()
+            results.append((fork.program_counter, list(fork.memory)))
+        assert results[0] == results[1] == results[2]
+        assert list(VM.fork(snapshot).memory) == list(vm.memory)
+
+class TestReverseExecution(unittest.TestCase):
+    def states(self, steps):
+        # Reference states before each step, from a VM without a journal
+        vm = VM()
+        vm.memory = COUNTDOWN_PROGRAM
+        states = []
+        for _ in range(steps):
+            states.append((vm.program_counter, vm.accumulator, list(vm.memory)))
+            vm.process_next_step()
+        return states
+
+    def journaled_vm(self, **kwargs):
+        vm = VM()
+        vm.output_func = lambda *args: None
+        vm.memory = COUNTDOWN_PROGRAM
+        vm.enable_journal(**kwargs)
+        return vm
+
+    # Stepping back undoes STOREs and stepping forward redoes them
+    def test_step_back_and_forward(self):
+        vm = self.journaled_vm()
+        for _ in range(3):
+            vm.step_forward()
+        assert vm.memory[10] == "+000499"
+        assert vm.step_back()
+        assert (vm.program_counter, vm.accumulator, vm.memory[10]) == (2, 499, "+000500")
+        assert vm.step_forward()
+        assert (vm.program_counter, vm.memory[10], vm.instruction_count) == (3, "+000499", 3)
+        assert vm.step_back() and vm.step_back() and vm.step_back()
+        assert not vm.step_back()
+
+    # Any recorded step can be revisited after a full run, via the nearest checkpoint
+    def test_goto_after_run(self):
+        states = self.states(2000)
+        vm = self.journaled_vm(checkpoint_interval=64)
+        vm.run()
+        for step in (1500, 3, 1999, 640, 0):
+            assert vm.goto(step)
+            assert vm.instruction_count == step
+            assert (vm.program_counter, vm.accumulator, list(vm.memory)) == states[step]
+        assert vm.run_back_to(8) is False
+        vm.goto(100)
+        assert vm.run_back_to(0) and vm.instruction_count == 99
+
+    # The journal keeps only the most recent steps
+    def test_history_is_bounded(self):
+        vm = self.journaled_vm(size=100, checkpoint_interval=32)
+        vm.run()
+        states = self.states(vm.instruction_count)
+        assert len(vm.journal.deltas) == 100
+        assert len(vm.journal.checkpoints) <= 4
+        assert not vm.goto(0)
+        assert vm.goto(vm.instruction_count - 90)
+        assert (vm.program_counter, vm.accumulator, list(vm.memory)) == states[vm.instruction_count]
+
+class TestLivePublishing(unittest.TestCase):
+    # Publishing in slices leaves every engine's result unchanged
+    def test_slices_match_plain_run(self):
+        for engine in ("interpreter", "block", "trace"):
+            results = []
+            for interval in (None, 7):
+                vm = VM(engine=engine)
+                vm.output_func = lambda *args: None
+                vm.memory = COUNTDOWN_PROGRAM
+                vm.publish_interval = interval
+                vm.run()
+                results.append((vm.program_counter, vm.accumulator, list(vm.memory), vm.instruction_count))
+            assert results[0] == results[1]
+            assert vm.published[:3] == (vm.program_counter - 1, vm.accumulator, vm.instruction_count)
+
+    # The step budget is still exact when it falls inside a slice
+    def test_step_limit_inside_slice(self):
+        vm = VM()
+        vm.memory = COUNTDOWN_PROGRAM
+        vm.publish_interval = 100
+        with self.assertRaises(StepLimitExceededError):
+            vm.run(max_steps=250)
+        assert vm.instruction_count == 250
+        assert vm.published[2] == 250
+
+ECHO_PROGRAM = [
+    "+010005",  # 0: READ 5
+    "+011005",  # 1: WRITE 5
+    "+020005",  # 2: LOAD 5
+    "+042004",  # 3: BRANCHZERO 4
+    "+043000",  # 4: HALT
+    "+000000"
+]
+
+class TestChannels(unittest.TestCase):
+    # Each VM talks to its own channels, even when several run at once
+    def test_concurrent_vms(self):
+        outputs = [ListChannel() for _ in range(8)]
+        def run(index):
+            vm = VM()
+            vm.memory = ECHO_PROGRAM
+            vm.set_io(ScriptedInput([index]), outputs[index])
+            vm.run()
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert [channel.outputs for channel in outputs] == [[f"+{i:06d}", "HALT."] for i in range(8)]
+
+    # Console and file channels read lines and write one output per line
+    def test_console_and_file_channels(self):
+        stdout = StringIO()
+        vm = VM()
+        vm.memory = ECHO_PROGRAM
+        vm.set_io(ConsoleChannel(StringIO("-000042\n"), stdout), None)
+        vm.set_io(output_channel=FileChannel(output_file=stdout))
+        vm.run()
+        assert stdout.getvalue().endswith("-000042\nHALT.\n")
+
+    # Running out of input is an error, not a hang
+    def test_input_exhausted(self):
+        for channel in (NullChannel(), FileChannel(StringIO("")), ScriptedInput([])):
+            vm = VM()
+            vm.memory = ECHO_PROGRAM
+            vm.set_io(channel, NullChannel())
+            with self.assertRaises(InputExhaustedError):
+                vm.run()
+
+class TestRunControl(unittest.TestCase):
+    # A run in another thread pauses at a control check and stops when asked
+    def test_pause_resume_stop(self):
+        vm = VM()
+        vm.memory = ["+040000"]
+        vm.control = RunControl()
+        vm.control.pause()
+        errors = []
+        def run():
+            try:
+                vm.run()
+            except ExecutionStoppedError as e:
+                errors.append(e)
+        thread = threading.Thread(target=run)
+        thread.start()
+        time.sleep(0.1)
+        assert vm.instruction_count == CONTROL_CHECK_INTERVAL
+        vm.control.resume()
+        time.sleep(0.05)
+        vm.control.stop()
+        thread.join(5)
+        assert not thread.is_alive() and len(errors) == 1
+        assert vm.instruction_count % CONTROL_CHECK_INTERVAL == 0
+
+class TestProcessWorker(unittest.TestCase):
+    def setUp(self):
+        self.vm = VM()
+        self.events = EventChannel()
+        self.worker = ProcessWorker(self.vm, self.events)
+        self.addCleanup(self.worker.close)
+
+    def wait(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while self.worker.running and time.monotonic() < deadline:
+            self.worker.poll()
+            time.sleep(0.01)
+        return self.events.drain()
+
+    # The worker runs on the GUI VM's memory and reports back its registers
+    def test_run_in_worker(self):
+        self.vm.memory = COUNTDOWN_PROGRAM
+        self.worker.run()
+        events = self.wait()
+        assert [type(event) for event in events] == [OutputEvent, HaltedEvent, StateChangedEvent]
+        assert (self.vm.program_counter, self.vm.instruction_count) == (10, 4499)
+        assert self.vm.memory[10] == "+000000"
+
+    # A runaway program can be paused, resumed and stopped over the pipe
+    def test_pause_and_stop(self):
+        self.vm.memory = ["+040000"]
+        self.worker.run()
+        self.worker.pause()
+        time.sleep(0.2)
+        paused_at = self.worker.published()
+        time.sleep(0.1)
+        assert self.worker.published() == paused_at
+        self.worker.resume()
+        self.worker.stop()
+        events = self.wait()
+        assert any(isinstance(event, ErrorEvent) and event.message == ERR_STOPPED for event in events)
+        assert self.vm.instruction_count > 0
+
+    # A runaway program can be killed, and the replacement worker keeps going
+    def test_kill_runaway_program(self):
+        self.vm.memory = ["+040000"]
+        self.worker.run()
+        time.sleep(0.2)
+        self.worker.kill()
+        assert self.vm.instruction_count > 0 and not self.worker.running
+        self.vm.memory = ["+043000"]
+        self.vm.program_counter = 0
+        self.worker.run()
+        assert self.wait()[-1] == StateChangedEvent() and self.vm.program_counter == 1
+
+    # Stop falls back to kill() when pressed again or when the worker does not answer in time
+    def test_stop_falls_back_to_kill(self):
+        self.vm.memory = ["+040000"]
+        self.worker.run()
+        self.worker.stop()
+        self.worker.stop()
+        assert not self.worker.running
+        assert any(isinstance(event, ErrorEvent) for event in self.events.drain())
+        self.worker.run()
+        self.worker.stop_requested = time.monotonic() - WORKER_STOP_TIMEOUT - 1
+        self.worker.conn.send(("pause",))
+        self.worker.poll()
+        assert not self.worker.running
+
+class TestGuiStop(unittest.TestCase):
+    # Stop releases a READ even before the input request reached the Tk thread,
+    # and a new run never sees a sentinel left over from the previous one
+    def test_stop_releases_pending_read(self):
+        from queue import Queue
+        from types import SimpleNamespace
+        from unittest.mock import Mock
+        app = SimpleNamespace(is_running=True, worker=None, waiting_for_input=False, vm=VM(),
+                              pause_button=Mock(), input_queue=Queue())
+        app.vm.control = RunControl()
+        VMApp.stop(app)
+        assert app.input_queue.get_nowait() is None
+        app.input_queue.put(None)
+        app.input_queue.put("5")
+        VMApp.drain_input(app)
+        assert app.input_queue.empty()
+
 class TestBranch(unittest.TestCase):
     # VM branches with valid address
     def test_valid_branch(self):
@@ -279,6 +1247,38 @@ class TestRun(unittest.TestCase):
         with self.assertRaises(Exception):
             vm.run()
 
+class TestEventChannel(unittest.TestCase):
+    # Writes between other events arrive as one output, in order
+    def test_outputs_merge_in_order(self):
+        channel = EventChannel()
+        output = TextRedirector(channel)
+        output.write("+000001\n")
+        output.write("+000002\n")
+        channel.post(InputRequestEvent("Enter"))
+        output.write("HALT.")
+        channel.post(HaltedEvent())
+        assert channel.drain() == [OutputEvent("+000001\n+000002\n"), InputRequestEvent("Enter"),
+                                   OutputEvent("HALT."), HaltedEvent()]
+        assert channel.drain() == []
+
+    # A flood of writes keeps the newest ones and reports how many were dropped
+    def test_bounded_output(self):
+        channel = EventChannel(output_capacity=3)
+        for i in range(10):
+            channel.post(OutputEvent(f"{i}\n"))
+        assert channel.drain() == [OutputEvent("[7 earlier outputs dropped]\n7\n8\n9\n")]
+
+    # Only the last state change of a batch is kept
+    def test_state_changes_coalesce(self):
+        channel = EventChannel()
+        channel.post(StateChangedEvent())
+        channel.post(OutputEvent("x"))
+        channel.post(StateChangedEvent())
+        channel.post(StateChangedEvent())
+        events = channel.drain()
+        assert [type(event) for event in events] == [OutputEvent, StateChangedEvent]
+        assert events[0].text == "x"
+
 class TestSaveFileMethod(unittest.TestCase):
     @patch('builtins.open', new_callable=mock_open)
     @patch('tkinter.filedialog.asksaveasfilename', return_value='test.txt')
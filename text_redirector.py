@@ -1,29 +1,30 @@
-class TextRedirector:
-    def __init__(self, string_var, app, tag="stdout"):
-        self.string_var = string_var
-        self.app = app
+from config import *
+from events import OutputEvent, InputRequestEvent
+from vm import ExecutionStoppedError
+from channels import Channel
+
+class TextRedirector(Channel):
+    '''Output channel that turns program output into events for the Tk thread'''
+    def __init__(self, channel, tag="stdout"):
+        self.channel = channel
         self.tag = tag
 
     def write(self, string):
-        current_value = self.string_var.get()
-        self.string_var.set(current_value + string)
-        if self.app.waiting_for_input:
-            self.app.display_prompt()
-
-    def flush(self):
-        pass
+        self.channel.post(OutputEvent(string))
 
-# Class to handle input redirection from the GUI console
-class InputRedirector:
-    def __init__(self, input_queue, app):
+# Input channel that asks the GUI console for each READ
+class InputRedirector(Channel):
+    def __init__(self, input_queue, channel):
         self.input_queue = input_queue
-        self.app = app
+        self.channel = channel
 
-    def readline(self, prompt=''):
-        self.app.waiting_for_input = True
+    def read(self, prompt=''):
         if prompt:
-            self.app.output_redirector.write(prompt)
-        self.app.display_prompt()
-        result = self.input_queue.get() + '\n'
-        self.app.waiting_for_input = False
-        return result
\ No newline at end of file
+            self.channel.post(OutputEvent(prompt))
+        # The Tk thread shows the prompt marker and starts accepting input
+        self.channel.post(InputRequestEvent(prompt))
+        text = self.input_queue.get()
+        if text is None:
+            # Stop was pressed while the program waited for input
+            raise ExecutionStoppedError(ERR_STOPPED)
+        return text + '\n'
@@ -0,0 +1,114 @@
+from array import array
+from collections import namedtuple
+from config import *
+from vm import VMError, InvalidWordError, OPERAND_BASE, WORD_TYPECODE, HALT
+
+LEGACY_WORD_LENGTH = 4
+LEGACY_OPCODES = frozenset(("10", "11", "20", "21", "30", "31", "32", "33", "40", "41", "42", "43"))
+DIGITS = frozenset("0123456789")
+
+# Diagnostic codes
+INVALID_LENGTH = "invalid-length"
+INVALID_SIGN = "invalid-sign"
+INVALID_DIGIT = "invalid-digit"
+PROGRAM_TOO_LARGE = "too-large"
+MISSING_HALT = "missing-halt"
+
+# line and column count from 1; both are 0 for problems with the program as a whole
+Diagnostic = namedtuple("Diagnostic", "line column code message")
+
+def format_diagnostic(diagnostic: Diagnostic) -> str:
+    if diagnostic.line == 0:
+        return diagnostic.message
+    return f"Line {diagnostic.line}, column {diagnostic.column}: {diagnostic.message}"
+
+class ParsedProgram:
+    '''Everything one pass over a program produced: its words, every diagnostic,
+    and optionally the normalized text of each line for the editor'''
+    def __init__(self, keep_text: bool = False):
+        self.words = array(WORD_TYPECODE)
+        self.diagnostics = []
+        self.texts = [] if keep_text else None
+        self.has_halt = False
+
+    @property
+    def ok(self) -> bool:
+        return not self.diagnostics
+
+    def raise_for_errors(self):
+        '''Raise the exception the loaders have always raised, led by the most serious diagnostic'''
+        if any(d.code == PROGRAM_TOO_LARGE for d in self.diagnostics):
+            raise MemoryError(ERR_PROGRAM_TOO_LARGE)
+        for diagnostic in self.diagnostics:
+            if diagnostic.code != MISSING_HALT:
+                raise InvalidWordError(format_diagnostic(diagnostic))
+        if self.diagnostics:
+            raise VMError(ERR_NO_HALT_INSTRUCTION)
+
+def parse_word(code: str):
+    '''Parse one stripped word, 6-digit or legacy 4-digit, into (value, legacy).
+    Returns (None, (column, code, message)) instead when the word is invalid.'''
+    length = len(code)
+    if length == WORD_LENGTH + 1:
+        legacy = False
+    elif length == LEGACY_WORD_LENGTH + 1:
+        legacy = True
+    else:
+        message = "Empty line" if not code else f"Invalid instruction: {code} (expected a sign and {WORD_LENGTH} digits)"
+        return None, (1, INVALID_LENGTH, message)
+    if code[0] not in "+-":
+        return None, (1, INVALID_SIGN, f"Invalid instruction: {code} (must start with + or -)")
+    digits = code[1:]
+    for column, character in enumerate(digits, 2):
+        if character not in DIGITS:
+            return None, (column, INVALID_DIGIT, f"Invalid instruction: {code} (unexpected {character!r})")
+    if legacy and digits[:2] in LEGACY_OPCODES:
+        value = int(digits[:2]) * OPERAND_BASE + int(digits[2:])
+    else:
+        value = int(digits)
+    return (-value if code[0] == "-" else value), legacy
+
+def convert_legacy_word(code: str) -> str:
+    '''Convert a 4-digit word to 6 digits; a word starting with a legacy opcode is taken as an instruction'''
+    if code[1:3] in LEGACY_OPCODES:
+        return f"{code[0]}0{code[1:3]}0{code[3:]}"
+    return f"{code[0]}00{code[1:]}"
+
+def parse_program(lines, skip_blank: bool = False, require_halt: bool = True, keep_text: bool = False) -> ParsedProgram:
+    '''Validate and encode a program in a single pass over an iterable of lines.
+
+    Every problem is recorded as a Diagnostic rather than raised, so a whole
+    file is checked at once. Legacy 4-digit words are converted exactly once.
+    skip_blank leaves blank lines as zero words instead of reporting them.
+    '''
+    program = ParsedProgram(keep_text)
+    words = program.words
+    diagnostics = program.diagnostics
+    texts = program.texts
+    too_large = False
+    for number, line in enumerate(lines, 1):
+        code = line.strip()
+        if skip_blank and not code:
+            value = 0
+        else:
+            value, detail = parse_word(code)
+            if value is None:
+                column, kind, message = detail
+                indent = len(line) - len(line.lstrip())
+                diagnostics.append(Diagnostic(number, indent + column, kind, message))
+                value = 0
+            else:
+                if abs(value) // OPERAND_BASE == HALT:
+                    program.has_halt = True
+                if detail:
+                    code = convert_legacy_word(code)
+        if texts is not None:
+            texts.append(code)
+        if number <= MEMORY_LENGTH:
+            words.append(value)
+        elif not too_large and (code or not skip_blank):
+            too_large = True
+            diagnostics.append(Diagnostic(number, 1, PROGRAM_TOO_LARGE, ERR_PROGRAM_TOO_LARGE))
+    if require_halt and not program.has_halt:
+        diagnostics.append(Diagnostic(0, 0, MISSING_HALT, ERR_NO_HALT_INSTRUCTION))
+    return program
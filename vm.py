@@ -1,4 +1,61 @@
+import io
+import os
+import struct
+import sys
+import threading
+import time
+from mmap import mmap
+from array import array
+from contextlib import contextmanager
 from config import *
+from journal import StepJournal
+
+# Machine words are held as signed integers in a compact fixed-width buffer;
+# "q" (64-bit) leaves plenty of headroom for any configured WORD_LENGTH.
+WORD_TYPECODE = "q"
+BLANK_WORD = "+" + ("0" * WORD_LENGTH)
+# Accumulator values must satisfy -WORD_MODULUS < value < WORD_MODULUS
+WORD_MODULUS = 10**WORD_LENGTH
+
+# Instruction words are laid out as +OOOAAA: a three digit opcode followed by
+# a three digit operand address.
+OPERAND_BASE = 1000
+
+READ = 10
+WRITE = 11
+LOAD = 20
+STORE = 21
+ADD = 30
+SUBTRACT = 31
+DIVIDE = 32
+MULTIPLY = 33
+BRANCH = 40
+BRANCHNEG = 41
+BRANCHZERO = 42
+HALT = 43
+
+def format_word(value: int) -> str:
+    '''Format an integer word as a signed, zero-padded string, e.g. 7 -> "+000007"'''
+    return f"{value:+0{WORD_LENGTH + 1}d}"
+
+# Pristine images that resets copy from; never modify these
+BLANK_MEMORY = array(WORD_TYPECODE, [0]) * MEMORY_LENGTH
+BLANK_DECODED = (None,) * MEMORY_LENGTH
+
+# Execution traces: a header, then one record per executed instruction with
+# its address, the instruction word and the accumulator afterwards
+TRACE_VERSION = 1
+TRACE_RECORD = struct.Struct("<Hqq")
+TRACE_HEADER = b"UVTR" + struct.pack("<HH", TRACE_VERSION, TRACE_RECORD.size)
+
+def wrap_word(value: int) -> int:
+    '''Keep the low WORD_LENGTH digits of value, preserving its sign'''
+    return value % WORD_MODULUS if value >= 0 else -(-value % WORD_MODULUS)
+
+def truncating_divide(dividend: int, divisor: int) -> int:
+    '''Exact integer division rounding toward zero, like int(dividend / divisor) without floats'''
+    quotient = abs(dividend) // abs(divisor)
+    return quotient if (dividend < 0) == (divisor < 0) else -quotient
 
 class VMError(Exception):
     """Base class for VM-related errors."""
@@ -16,21 +73,334 @@ class InvalidOpcodeError(VMError):
     """Raised when an invalid opcode is encountered."""
     pass
 
-class VM:
+class InputExhaustedError(VMError):
+    """Raised when a READ runs out of scripted input."""
+    pass
+
+class StepLimitExceededError(VMError):
+    """Raised when a run executes more instructions than its budget allows."""
+    pass
+
+class ExecutionStoppedError(VMError):
+    """Raised when a run is stopped through its RunControl."""
+    pass
+
+class InfiniteLoopError(VMError):
+    """Raised when the VM returns to an earlier state, so the program can never halt."""
+    def __init__(self, entry_pc: int, period: int):
+        super().__init__(ERR_INFINITE_LOOP.format(entry_pc, period))
+        self.entry_pc = entry_pc
+        self.period = period
+
+class RunControl:
+    '''Pause/resume/stop token for a running VM, driven from another thread.
+
+    The VM only looks at it between slices of CONTROL_CHECK_INTERVAL
+    instructions, so the run loops themselves pay nothing for it.
+    '''
     def __init__(self):
+        self._resumed = threading.Event()
+        self.reset()
+
+    def reset(self):
+        self.stopped = False
+        self._resumed.set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._resumed.is_set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def stop(self):
+        self.stopped = True
+        self._resumed.set()
+
+    def wait(self) -> bool:
+        '''Block while paused. Returns False once the run should stop'''
+        self._resumed.wait()
+        return not self.stopped
+
+class WordMemory:
+    '''Signed-string view over a VM's integer memory.
+
+    Reads format the stored integer (memory[3] -> "+020007") and writes accept
+    either a word string or an int, so callers that treat memory as a list of
+    strings keep working while the VM itself only touches integers.
+    '''
+    def __init__(self, vm):
+        self._vm = vm
+
+    def __len__(self):
+        return len(self._vm._words)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [format_word(word) for word in self._vm._words[index]]
+        return format_word(self._vm._words[index])
+
+    def __setitem__(self, index, word):
+        if self._vm._shared:
+            self._vm._unshare()
+        self._vm._words[index] = int(word)
+        self._vm.invalidate(index)
+        self._vm.dirty.add(index)
+
+    def __iter__(self):
+        return (format_word(word) for word in self._vm._words)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+ENGINES = ("interpreter", "block", "trace")
+
+class VMSnapshot:
+    '''Immutable image of a VM's memory and registers, taken with VM.snapshot().
+
+    words is a read-only integer view over data; VMs forked from the snapshot
+    read straight from it until their first write.
+    '''
+    __slots__ = ("data", "words", "program_counter", "accumulator")
+
+    def __init__(self, data: bytes, program_counter: int = 0, accumulator: int = 0):
+        self.data = data
+        self.words = memoryview(data).cast(WORD_TYPECODE)
+        self.program_counter = program_counter
+        self.accumulator = accumulator
+
+    def __reduce__(self):
+        return (VMSnapshot, (self.data, self.program_counter, self.accumulator))
+
+class VM:
+    def __init__(self, engine: str = "interpreter"):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
         self.program_counter = 0
         self.accumulator = 0
+        self.instruction_count = 0
+        self.overflow_count = 0
+        self._memory_view = WordMemory(self)
+        self._words = array(WORD_TYPECODE, BLANK_MEMORY)
+        self._shared = False  # True while _words is a snapshot's read-only view
+        self._decoded = list(BLANK_DECODED)
+        self._handlers = {
+            READ: self.read_op,
+            WRITE: self.write_op,
+            LOAD: self.load_op,
+            STORE: self.store_op,
+            ADD: self.add_op,
+            SUBTRACT: self.subtract_op,
+            DIVIDE: self.divide_op,
+            MULTIPLY: self.multiply_op,
+            BRANCH: self._jump,
+            BRANCHNEG: self._jump_if_negative,
+            BRANCHZERO: self._jump_if_zero,
+            HALT: self.halt_op
+        }
+        self._engine = None
+        self.journal = None
+        # Addresses written since the last take_dirty(), for displays that repaint only what changed.
+        # Wholesale replacements (reset, restore, loads) just set _all_dirty instead of filling the set.
+        self.dirty = set()
+        self._all_dirty = True
         self.reset_memory()
+        if engine == "block":
+            from compiler import BlockCompiler
+            self._engine = BlockCompiler(self)
+        elif engine == "trace":
+            from compiler import TraceCompiler
+            self._engine = TraceCompiler(self)
         self.input_func = input
         self.output_func = print
         self.halted = False
+        self.max_steps = None
+        self.detect_loops = False
+        # When set, run() publishes (pc, accumulator, instruction_count, time) every this many instructions
+        self.publish_interval = None
+        self.published = None
+        self.control = None
+        self.trace = None  # Binary file that receives a TRACE_RECORD per instruction when set
     
     def set_io_functions(self, input_func, output_func):
         self.input_func = input_func
         self.output_func = output_func
+
+    def set_io(self, input_channel=None, output_channel=None):
+        '''Read from input_channel and write to output_channel (see channels.py); None keeps the current one'''
+        if input_channel is not None:
+            self.input_func = input_channel.read
+        if output_channel is not None:
+            self.output_func = output_channel.write
     
+    @property
+    def memory(self) -> WordMemory:
+        return self._memory_view
+
+    @memory.setter
+    def memory(self, words):
+        self.reset_memory()
+        count = 0
+        for i, word in enumerate(words):
+            self._words[i] = int(word)
+            count = i + 1
+        # Blank words past the program decode lazily if they are ever reached
+        for address in range(count):
+            self.decode(address)
+
     def reset_memory(self):
-        self.memory = ["+" + ("0" * WORD_LENGTH)] * MEMORY_LENGTH
+        '''Zero memory in place by copying the blank template image'''
+        self._all_dirty = True
+        if self._shared:
+            self._words = array(WORD_TYPECODE, BLANK_MEMORY)
+            self._shared = False
+        else:
+            self._words[:] = BLANK_MEMORY
+        self._decoded[:] = BLANK_DECODED
+        if self._engine is not None:
+            self._engine.mark_stale()
+        if self.journal is not None:
+            self.journal.clear(self.instruction_count)
+
+    def _load_words(self, data: bytes):
+        '''Replace the contents of memory with a raw word image'''
+        words = array(WORD_TYPECODE)
+        words.frombytes(data)
+        self._all_dirty = True
+        if self._shared:
+            self._words = words
+            self._shared = False
+        else:
+            self._words[:] = words
+        self._decoded[:] = BLANK_DECODED
+        if self._engine is not None:
+            self._engine.mark_stale()
+
+    def load_image_words(self, words):
+        '''Replace memory with a buffer of int64 words, such as a mapped program image,
+        in a single block copy'''
+        count = len(words)
+        if count > MEMORY_LENGTH:
+            raise MemoryError(ERR_PROGRAM_TOO_LARGE)
+        self.reset_memory()
+        with memoryview(self._words) as target:
+            target[:count] = words
+
+    def attach_memory(self, words):
+        '''Use words, any writable buffer of MEMORY_LENGTH int64 items such as a
+        shared memory block cast to "q", as this VM's memory from now on'''
+        self._words = words
+        self._shared = False
+        self.memory_changed()
+
+    def memory_changed(self):
+        '''Drop everything decoded or compiled after memory was written from outside the VM'''
+        self._decoded[:] = BLANK_DECODED
+        if self._engine is not None:
+            self._engine.mark_stale()
+        self._all_dirty = True
+
+    def write_word(self, address: int, word: int):
+        '''Write a word to memory, dropping anything decoded or compiled from the old one'''
+        if self._shared:
+            self._unshare()
+        self._words[address] = word
+        self.invalidate(address)
+        self.dirty.add(address)
+
+    def reset(self):
+        '''Return the machine to its power-on state, keeping I/O functions, engine and limits'''
+        self.program_counter = 0
+        self.accumulator = 0
+        self.instruction_count = 0
+        self.overflow_count = 0
+        self.halted = False
+        self.reset_memory()
+
+    def snapshot(self) -> VMSnapshot:
+        '''Capture memory, program counter and accumulator as an immutable image'''
+        return VMSnapshot(self._words.tobytes(), self.program_counter, self.accumulator)
+
+    def restore(self, snapshot: VMSnapshot):
+        '''Reset this VM and start it from snapshot, sharing the snapshot's memory until the first write'''
+        self.instruction_count = 0
+        self.overflow_count = 0
+        self.halted = False
+        self._all_dirty = True
+        self._words = snapshot.words
+        self._shared = True
+        self._decoded[:] = BLANK_DECODED
+        if self._engine is not None:
+            self._engine.mark_stale()
+        if self.journal is not None:
+            self.journal.clear()
+        self.program_counter = snapshot.program_counter
+        self.accumulator = snapshot.accumulator
+
+    @classmethod
+    def fork(cls, snapshot: VMSnapshot, engine: str = "interpreter") -> "VM":
+        '''Create a VM that starts from snapshot without reloading the program'''
+        vm = cls(engine=engine)
+        vm.restore(snapshot)
+        return vm
+
+    def _unshare(self):
+        '''Copy shared snapshot memory into a private buffer before it is written'''
+        words = array(WORD_TYPECODE)
+        words.frombytes(self._words.cast("B"))
+        self._words = words
+        self._shared = False
+
+    def decode(self, address: int) -> tuple:
+        '''Decode the word at address into an (opcode, handler, operand) entry and cache it.
+
+        Words that cannot execute decode to a handler that raises, so the error
+        only surfaces if the program actually reaches them.
+        '''
+        opcode, operand = divmod(abs(self._words[address]), OPERAND_BASE)
+        handler = self._handlers.get(opcode)
+        if operand >= MEMORY_LENGTH and opcode != HALT:
+            entry = (opcode, self._invalid_address, operand)
+        elif handler is None:
+            entry = (opcode, self._invalid_opcode, opcode)
+        else:
+            entry = (opcode, handler, operand)
+        self._decoded[address] = entry
+        return entry
+
+    def invalidate(self, address: int):
+        '''Discard anything decoded or compiled from the word at address after it is written'''
+        self._decoded[address] = None
+        if self._engine is not None:
+            self._engine.invalidate(address)
+
+    def take_dirty(self) -> list:
+        '''Return the addresses written since the last call, in order, and start tracking afresh.
+
+        Safe to call from another thread while the VM runs: addresses are popped
+        one at a time, so a concurrent write is either taken now or next time.
+        '''
+        dirty = self.dirty
+        if self._all_dirty:
+            self._all_dirty = False
+            dirty.clear()
+            return list(range(len(self._words)))
+        addresses = []
+        while dirty:
+            addresses.append(dirty.pop())
+        addresses.sort()
+        return addresses
+
+    def decode_program(self):
+        '''Rebuild the decoded instruction cache for every address in memory'''
+        for address in range(len(self._words)):
+            self.decode(address)
 
     def halt(self):
         self.halted = True
@@ -38,16 +408,20 @@ class VM:
     def is_valid_word(self, word: str) -> bool:
         try:
             int_value = int(word)
-            return -10**WORD_LENGTH < int_value < 10**WORD_LENGTH
+            return -WORD_MODULUS < int_value < WORD_MODULUS
         except ValueError:
             return False
 
     def accumulator_overflow(self):
-        return abs(self.accumulator) >= 10**WORD_LENGTH
+        return not -WORD_MODULUS < self.accumulator < WORD_MODULUS
     
     def truncate_accumulator(self):
-        adjusted_acc_string = str(abs(self.accumulator))[-WORD_LENGTH:]
-        self.accumulator = int(adjusted_acc_string) if self.accumulator >= 0 else -int(adjusted_acc_string)
+        self.accumulator = wrap_word(self.accumulator)
+
+    def overflow(self, value: int) -> int:
+        '''Record an arithmetic overflow and return value wrapped to a word'''
+        self.overflow_count += 1
+        return wrap_word(value)
 
     def read_op(self, operand: int):
         while True:
@@ -61,52 +435,90 @@ class VM:
             except EOFError:
                 self.output_func("\nPlease enter input on the last line of the console. Try again.")
 
-        self.memory[operand] = f"{int(word):+07d}"
+        if self._shared:
+            self._unshare()
+        self._words[operand] = int(word)
+        self.invalidate(operand)
+        self.dirty.add(operand)
     
     def write_op(self, operand: int):
-        self.output_func(self.memory[operand] + '\n')
+        self.output_func(format_word(self._words[operand]) + '\n')
     
     def load_op(self, operand: int):
-        self.accumulator = int(self.memory[operand])
+        self.accumulator = self._words[operand]
     
     def store_op(self, operand: int):
         '''Store a word from the accumulator into a specific location in memory'''
-        if self.accumulator < 0:
-            self.memory[operand] = f"{str(self.accumulator).zfill(7)}"
-        else:
-            self.memory[operand] = f"+{str(self.accumulator).zfill(6)}"
+        if self._shared:
+            self._unshare()
+        self._words[operand] = self.accumulator
+        self._decoded[operand] = None
+        self.dirty.add(operand)
+        if self._engine is not None:
+            self._engine.invalidate(operand)
     
+    # Only ADD, SUBTRACT and MULTIPLY can leave the word range, so they wrap
+    # their own results and nothing else in the run loop checks for overflow.
     def add_op(self, operand: int):
-        self.accumulator += int(self.memory[operand])
+        accumulator = self.accumulator + self._words[operand]
+        if accumulator >= WORD_MODULUS or accumulator <= -WORD_MODULUS:
+            accumulator = self.overflow(accumulator)
+        self.accumulator = accumulator
     
     def subtract_op(self, operand: int):
-        self.accumulator -= int(self.memory[operand])
+        accumulator = self.accumulator - self._words[operand]
+        if accumulator >= WORD_MODULUS or accumulator <= -WORD_MODULUS:
+            accumulator = self.overflow(accumulator)
+        self.accumulator = accumulator
     
     def divide_op(self, operand: int):
-        divisor = int(self.memory[operand])
+        divisor = self._words[operand]
         if divisor == 0:
             raise ZeroDivisionError("Cannot divide by zero")
-        self.accumulator = int(self.accumulator / divisor)
+        self.accumulator = truncating_divide(self.accumulator, divisor)
     
     def multiply_op(self, operand: int):
-        self.accumulator *= int(self.memory[operand])
+        accumulator = self.accumulator * self._words[operand]
+        if accumulator >= WORD_MODULUS or accumulator <= -WORD_MODULUS:
+            accumulator = self.overflow(accumulator)
+        self.accumulator = accumulator
     
     def branch_op(self, addr: int):
         if addr < 0 or addr >= MEMORY_LENGTH:
             raise InvalidMemoryAddressError(ERR_INVALID_MEMORY_ADDRESS.format(addr))
-        self.program_counter = addr
+        self._jump(addr)
     
     def branchneg_op(self, addr: int):
         if addr < 0 or addr >= MEMORY_LENGTH:
             raise InvalidMemoryAddressError(ERR_INVALID_MEMORY_ADDRESS.format(addr))
-        if self.accumulator < 0:
-            self.program_counter = addr
+        self._jump_if_negative(addr)
     
     def branchzero_op(self, addr: int):
         if addr < 0 or addr >= MEMORY_LENGTH:
             raise InvalidMemoryAddressError(ERR_INVALID_MEMORY_ADDRESS.format(addr))
+        self._jump_if_zero(addr)
+
+    # Decoded branches skip the range check: decode() already validated the operand
+    def _jump(self, addr: int):
+        self.program_counter = addr
+
+    def _jump_if_negative(self, addr: int):
+        if self.accumulator < 0:
+            self.program_counter = addr
+
+    def _jump_if_zero(self, addr: int):
         if self.accumulator == 0:
             self.program_counter = addr
+
+    def halt_op(self, operand: int):
+        pass
+
+    def _invalid_address(self, operand: int):
+        self.program_counter -= 1  # Report the faulting instruction, as before decoding was cached
+        raise InvalidMemoryAddressError(ERR_INVALID_MEMORY_ADDRESS.format(operand))
+
+    def _invalid_opcode(self, opcode: int):
+        raise InvalidOpcodeError(ERR_INVALID_OPCODE.format(f"{opcode:03d}"))
     
     def __str__(self):
         vm_info = ("~" * 50) + "\n"
@@ -119,148 +531,410 @@ class VM:
         return vm_info
 
     def get_opcode(self, index) -> str:
-        code = self.memory[index]
-        return code[1:4]
+        return f"{abs(self._words[index]) // OPERAND_BASE:03d}"
     
     def process_next_step(self):
-        code = self.memory[self.program_counter]
-        opcode: str = self.get_opcode(self.program_counter)
-        operand: int = int(code[4:7])
-
-        if operand >= MEMORY_LENGTH:
-            raise InvalidMemoryAddressError(ERR_INVALID_MEMORY_ADDRESS.format(operand))
+        if self.journal is not None:
+            return self._journaled_step()
+        opcode, handler, operand = self._decoded[self.program_counter] or self.decode(self.program_counter)
+        self.program_counter += 1
+        self.instruction_count += 1
+        handler(operand)
 
+    def _journaled_step(self):
+        '''Execute one instruction like process_next_step and record how to undo it'''
+        journal = self.journal
+        journal.before_step(self)
+        before = (self.program_counter, self.accumulator, self.overflow_count)
+        opcode, handler, operand = self._decoded[self.program_counter] or self.decode(self.program_counter)
+        address = operand if (opcode == STORE or opcode == READ) and operand < MEMORY_LENGTH else None
+        old_word = None if address is None else self._words[address]
         self.program_counter += 1
+        self.instruction_count += 1
+        try:
+            handler(operand)
+        finally:
+            journal.record(before, address, old_word, self)
 
-        operation = {
-            "010": self.read_op,
-            "011": self.write_op,
-            "020": self.load_op,
-            "021": self.store_op,
-            "030": self.add_op,
-            "031": self.subtract_op,
-            "032": self.divide_op,
-            "033": self.multiply_op,
-            "040": self.branch_op,
-            "041": self.branchneg_op,
-            "042": self.branchzero_op,
-            "043": lambda x: None  # HALT operation
-        }.get(opcode)
-
-        if operation is None:
-            raise InvalidOpcodeError(ERR_INVALID_OPCODE.format(opcode))
-        
-        operation(operand)
+    def enable_journal(self, size: int = JOURNAL_SIZE, checkpoint_interval: int = JOURNAL_CHECKPOINT_INTERVAL):
+        '''Record every executed step so it can be undone; see StepJournal'''
+        self.journal = StepJournal(size, checkpoint_interval)
+        self.journal.clear(self.instruction_count)
+
+    def disable_journal(self):
+        self.journal = None
+
+    def step_back(self) -> bool:
+        '''Undo the last executed step. Returns False if no earlier step is recorded'''
+        return self.journal is not None and self.journal.undo(self)
+
+    def step_forward(self) -> bool:
+        '''Redo the next recorded step, or execute a new one. Returns False at HALT'''
+        if self.journal is not None and self.journal.redo(self):
+            return True
+        if (self._decoded[self.program_counter] or self.decode(self.program_counter))[0] == HALT:
+            return False
+        self.process_next_step()
+        return True
+
+    def run_back_to(self, pc: int) -> bool:
+        '''Step back until the program counter is pc again. Returns False if history ran out first'''
+        while self.step_back():
+            if self.program_counter == pc:
+                return True
+        return False
+
+    def goto(self, step: int) -> bool:
+        '''Move to the state just before step executed, reversing or re-running as needed.
 
-        if self.accumulator_overflow():
-            self.truncate_accumulator()
+        Recorded steps are reached from the nearest checkpoint; steps past the
+        end of the history are executed. Returns False if step is out of reach.
+        '''
+        journal = self.journal
+        if journal is None:
+            return False
+        if step <= journal.end:
+            return journal.goto(self, step)
+        if not journal.goto(self, journal.end):
+            return False
+        while self.instruction_count < step:
+            if not self.step_forward():
+                return False
+        return True
 
-    def run(self):
+    def run(self, max_steps: int = None, detect_loops: bool = None):
+        '''Run until HALT.
+
+        max_steps caps the number of instructions this run may execute and
+        detect_loops enables exact infinite-loop detection; both default to the
+        VM's max_steps and detect_loops attributes.
+        '''
         self.halted = False
-        while not self.halted and self.get_opcode(self.program_counter) != "043":
-            self.process_next_step()
+        max_steps = self.max_steps if max_steps is None else max_steps
+        detect_loops = self.detect_loops if detect_loops is None else detect_loops
+        limit = sys.maxsize if max_steps is None else self.instruction_count + max_steps
+        if self._shared and (detect_loops or self._engine is not None):
+            # These paths hold on to the memory buffer, so give them a private one up front
+            self._unshare()
+
+        if detect_loops:
+            execute = self._interpret_detecting_loops
+        elif self.journal is not None:
+            execute = self._interpret_journaled
+        elif self.trace is not None:
+            execute = self._interpret_traced
+        elif self._engine is not None:
+            execute = self._engine.run
+        else:
+            execute = self._interpret
+        if self.publish_interval or self.control is not None:
+            out_of_steps = self._run_sliced(execute, limit)
+        else:
+            out_of_steps = execute(limit)
+        if out_of_steps:
+            raise StepLimitExceededError(ERR_STEP_LIMIT.format(max_steps))
+
         self.output_func("HALT.")
         self.program_counter += 1
+
+    def publish(self):
+        '''Publish a consistent view of the registers for another thread to sample'''
+        self.published = (self.program_counter, self.accumulator, self.instruction_count, time.perf_counter())
+
+    def _run_sliced(self, execute, limit: int) -> bool:
+        '''Call execute in slices, publishing the state and checking the RunControl after each.
+
+        Slices last publish_interval instructions, or CONTROL_CHECK_INTERVAL if
+        that is shorter and a control is set. Every engine stops exactly at the
+        limit it is given, so slicing changes nothing about execution; loop
+        detection restarts each slice and still catches loops shorter than half
+        a slice.
+        '''
+        control = self.control
+        interval = min(self.publish_interval or sys.maxsize,
+                       CONTROL_CHECK_INTERVAL if control is not None else sys.maxsize)
+        self.publish()
+        while True:
+            slice_limit = min(limit, self.instruction_count + interval)
+            out_of_steps = execute(slice_limit)
+            self.publish()
+            if not out_of_steps:
+                return False
+            if slice_limit >= limit:
+                return True
+            if control is not None and not control.wait():
+                raise ExecutionStoppedError(ERR_STOPPED)
+
+    def _interpret(self, limit: int = sys.maxsize) -> bool:
+        '''Interpret until HALT or until instruction_count reaches limit. Returns True if the limit stopped it'''
+        decoded = self._decoded
+        remaining = limit - self.instruction_count
+        executed = 0
+        try:
+            while not self.halted:
+                opcode, handler, operand = decoded[self.program_counter] or self.decode(self.program_counter)
+                if opcode == HALT:
+                    return False
+                if executed >= remaining:
+                    return True
+                self.program_counter += 1
+                executed += 1
+                handler(operand)
+            return False
+        finally:
+            self.instruction_count += executed
+
+    def _interpret_journaled(self, limit: int = sys.maxsize) -> bool:
+        '''Interpret like _interpret, recording every step in the journal'''
+        decoded = self._decoded
+        while not self.halted:
+            if (decoded[self.program_counter] or self.decode(self.program_counter))[0] == HALT:
+                return False
+            if self.instruction_count >= limit:
+                return True
+            self._journaled_step()
+        return False
+
+    def _interpret_traced(self, limit: int = sys.maxsize) -> bool:
+        '''Interpret like _interpret, writing a TRACE_RECORD for every completed instruction to self.trace'''
+        decoded = self._decoded
+        pack = TRACE_RECORD.pack
+        buffer = bytearray()
+        try:
+            while not self.halted:
+                pc = self.program_counter
+                opcode, handler, operand = decoded[pc] or self.decode(pc)
+                if opcode == HALT:
+                    return False
+                if self.instruction_count >= limit:
+                    return True
+                word = self._words[pc]
+                self.program_counter = pc + 1
+                self.instruction_count += 1
+                handler(operand)
+                buffer += pack(pc, word, self.accumulator)
+                if len(buffer) >= 65536:
+                    self.trace.write(buffer)
+                    buffer.clear()
+            return False
+        finally:
+            self.trace.write(buffer)
+
+    def _interpret_detecting_loops(self, limit: int = sys.maxsize) -> bool:
+        '''Interpret like _interpret, raising InfiniteLoopError as soon as a full state repeats.
+
+        Uses Brent's cycle detection: the state is checkpointed after 1, 2, 4, ...
+        steps and every later state is compared against the checkpoint. The memory
+        part of the state is an XOR of per-word hashes updated on every STORE and
+        READ, so the comparison stays O(1) per step; a full memory comparison only
+        runs when the hashes match. A READ restarts detection, because new input
+        can break a loop that would otherwise repeat.
+
+        Once a repeat is found the loop's entry is located with Brent's second
+        phase, replayed from the state saved at the start or after the last READ.
+        '''
+        words = self._words
+        decoded = self._decoded
+        memory_hash = 0
+        for address, word in enumerate(words):
+            memory_hash ^= hash((address, word))
+
+        checkpoint = (self.program_counter, self.accumulator, memory_hash)
+        checkpoint_words = array(WORD_TYPECODE, words)
+        origin = VMSnapshot(checkpoint_words.tobytes(), self.program_counter, self.accumulator)
+        power = 1
+        since = 0
+        while not self.halted:
+            opcode, handler, operand = decoded[self.program_counter] or self.decode(self.program_counter)
+            if opcode == HALT:
+                return False
+            if self.instruction_count >= limit:
+                return True
+            self.program_counter += 1
+            self.instruction_count += 1
+            writes = (opcode == STORE or opcode == READ) and operand < MEMORY_LENGTH
+            if writes:
+                old_word = words[operand]
+            handler(operand)
+            if writes:
+                memory_hash ^= hash((operand, old_word)) ^ hash((operand, words[operand]))
+
+            state = (self.program_counter, self.accumulator, memory_hash)
+            since += 1
+            if opcode != READ and state == checkpoint and words == checkpoint_words:
+                raise InfiniteLoopError(self._find_loop_entry(origin, since), since)
+            if since == power or opcode == READ:
+                checkpoint = state
+                checkpoint_words = array(WORD_TYPECODE, words)
+                if opcode == READ:
+                    origin = VMSnapshot(checkpoint_words.tobytes(), self.program_counter, self.accumulator)
+                power = 1 if opcode == READ else power * 2
+                since = 0
+        return False
     
+    @staticmethod
+    def _find_loop_entry(origin: VMSnapshot, period: int) -> int:
+        '''Address of the loop's entry: the first state reached from origin that recurs.
+        A hare started period steps ahead of a tortoise meets it exactly there.'''
+        tortoise, hare = VM.fork(origin), VM.fork(origin)
+        for vm in (tortoise, hare):
+            vm.set_io_functions(None, lambda text: None)
+        for _ in range(period):
+            hare.process_next_step()
+        while (tortoise.program_counter != hare.program_counter or tortoise.accumulator != hare.accumulator
+               or memoryview(tortoise._words) != memoryview(hare._words)):
+            tortoise.process_next_step()
+            hare.process_next_step()
+        return tortoise.program_counter
+
     def run_by_step(self):
-        while self.get_opcode(self.program_counter) != "043":
+        decoded = self._decoded
+        while (decoded[self.program_counter] or self.decode(self.program_counter))[0] != HALT:
             self.process_next_step()
             yield
         self.output_func("HALT.")
         self.program_counter += 1
         
+class VMPool:
+    '''Hands out reusable VMs so high-volume callers skip constructing a VM per run.
+
+    A released VM is reset in place (see VM.reset) and handed to the next
+    caller; at most max_idle VMs are kept waiting. Acquire and release are
+    safe to call from multiple threads.
+    '''
+    def __init__(self, engine: str = "interpreter", max_idle: int = 64):
+        self.engine = engine
+        self.max_idle = max_idle
+        self._idle = []
+
+    def acquire(self) -> VM:
+        try:
+            return self._idle.pop()
+        except IndexError:
+            return VM(engine=self.engine)
+
+    def release(self, vm: VM):
+        if len(self._idle) < self.max_idle:
+            vm.reset()
+            self._idle.append(vm)
+
+    def fork(self, snapshot: VMSnapshot) -> VM:
+        '''Acquire a VM already restored to snapshot'''
+        vm = self.acquire()
+        vm.restore(snapshot)
+        return vm
+
+    @contextmanager
+    def borrow(self):
+        '''Acquire a VM for the duration of a with block'''
+        vm = self.acquire()
+        try:
+            yield vm
+        finally:
+            self.release(vm)
+
 class ProgramLoader():
-    old_word_length = 5
-    old_op_codes = ("10", "11", "20", "21", "30", "31", "32", "33", "40", "41", "42", "43")
-    
-    old_word_length = 5
-    old_op_codes = ("10", "11", "20", "21", "30", "31", "32", "33", "40", "41", "42", "43")
-    
+    '''Loads programs into VMs. Every text entry point goes through the single-pass
+    parser in validator.py, so they all accept and convert words the same way.'''
     @staticmethod
-    def validate_code_format(code: str) -> str:
-        if len(code) != 7 or code[0] not in ('+', '-') or not code[1:].isdigit():
-            raise InvalidWordError(f"Invalid instruction: {code}")
-        
-    def convert_four_to_six(self, code: str) -> str:
-        '''Convert a 4-length word to 6-length'''
-        new_code = code
+    def validate_code_format(code: str):
+        from validator import parse_word
+        value, problem = parse_word(code)
+        if value is None:
+            raise InvalidWordError(problem[2])
 
-        if code[1:3] in self.old_op_codes:
-            new_code = f"{code[0]}0{code[1:3]}0{code[3:]}"
-        else:
-            new_code = f"{code[0]}00{code[1:]}"
-        
-        return new_code
-        
     def convert_four_to_six(self, code: str) -> str:
         '''Convert a 4-length word to 6-length'''
-        new_code = code
+        from validator import convert_legacy_word
+        return convert_legacy_word(code)
 
-        if code[1:3] in self.old_op_codes:
-            new_code = f"{code[0]}0{code[1:3]}0{code[3:]}"
-        else:
-            new_code = f"{code[0]}00{code[1:]}"
-        
-        return new_code
-
-    def load(self, vm: VM, filepath: str):
-        user_program = ["+" + ("0" * WORD_LENGTH)] * MEMORY_LENGTH
-        has_halt = False
-        with open(filepath, "r") as f:
-            lines = f.readlines()
-            if len(lines) > MEMORY_LENGTH:
-                raise MemoryError(ERR_PROGRAM_TOO_LARGE)
-            
-            for i in range(len(lines)):
-                code = lines[i].strip()
-                if len(code) == self.old_word_length:
-                    code = self.convert_four_to_six(code)
-
-                self.validate_code_format(code)
-                
-                if code[1:4] == "043":
-                    has_halt = True
-                
-                user_program[i] = code
-
-        if not has_halt:
-            raise VMError(ERR_NO_HALT_INSTRUCTION)
-        
-        vm.memory = user_program
+    def check(self, source):
+        '''Validate a program from any source load accepts, returning the ParsedProgram with every diagnostic'''
+        from sources import program_source
+        from validator import parse_program, ParsedProgram
+        from image import image_array
+        with program_source(source) as program:
+            if isinstance(program, (bytes, bytearray, memoryview, mmap)):
+                parsed = ParsedProgram()
+                parsed.words = image_array(program)
+                return parsed
+            return parse_program(program)
+
+    def load(self, vm: VM, source):
+        '''Load a program from a path, an "archive.zip/member" path into a .zip or .tar
+        archive, an open file such as sys.stdin, bytes, a memoryview or any iterable
+        of text lines. Binary images are recognised by their header and copied in
+        directly; .asm paths are assembled; text is parsed line by line as it is read.'''
+        from sources import program_source
+        from validator import parse_program
+        from image import load_image_buffer
+        from assembler import ASSEMBLY_SUFFIX
+        if isinstance(source, (str, os.PathLike)) and os.fspath(source).endswith(ASSEMBLY_SUFFIX):
+            return self.load_assembly(vm, source)
+        with program_source(source) as program:
+            if isinstance(program, (bytes, bytearray, memoryview, mmap)):
+                load_image_buffer(vm, program)
+                return
+            parsed = parse_program(program)
+        parsed.raise_for_errors()
+        vm.memory = parsed.words
+
+    def load_assembly(self, vm: VM, source):
+        '''Assemble mnemonic source through the assembler's cache and load the words,
+        so a corpus of .asm submissions is only assembled once'''
+        from sources import program_source
+        from assembler import assemble_cached
+        from image import check_words
+        with program_source(source) as program:
+            words = assemble_cached("".join(program))
+        check_words(words)
+        self.load_words(vm, words)
 
     def load_string(self, vm: VM, program: str):
-        words = [line.strip() for line in program.split("\n")]
+        from validator import parse_program
+        parsed = parse_program(io.StringIO(program), skip_blank=True, require_halt=False)
+        parsed.raise_for_errors()
+        vm.memory = parsed.words
+    
+    def load_words(self, vm: VM, words):
+        '''Load an already-encoded word image, such as an assembler's output, without parsing text'''
         if len(words) > MEMORY_LENGTH:
             raise MemoryError(ERR_PROGRAM_TOO_LARGE)
+        for word in words:
+            if not -WORD_MODULUS < word < WORD_MODULUS:
+                raise InvalidWordError(f"Invalid instruction: {word}")
+        vm.memory = words
 
-        vm.reset_memory()
-        for i, code in enumerate(words):
-            if not code:
-                continue
-            if len(code) == self.old_word_length:
-                code = self.convert_four_to_six(code)
-            self.validate_code_format(code)
-            if len(code) == self.old_word_length:
-                code = self.convert_four_to_six(code)
-            vm.memory[i] = code
-    
-    def force_load(self, filepath: str, object):
-        object.memory = []
-        with open(filepath, "r") as f:
-            lines = f.readlines()
-        
-        for line in lines:
-            code = line.strip()
-            if len(code) == self.old_word_length:
-                code = self.convert_four_to_six(code)
-            if len(code) == self.old_word_length:
-                code = self.convert_four_to_six(code)
-            object.memory.append(code)
+    def compile_image(self, filepath: str, image_path: str = None) -> str:
+        '''Validate a text program and write it as a binary image (next to it by default)'''
+        from image import IMAGE_SUFFIX, write_image
+        program = self.check(filepath)
+        program.raise_for_errors()
+        words = program.words
+        count = len(words)
+        while count and not words[count - 1]:
+            count -= 1
+        if image_path is None:
+            image_path = os.path.splitext(filepath)[0] + IMAGE_SUFFIX
+        write_image(image_path, words[:count])
+        return image_path
+
+    def force_load(self, source, object):
+        '''Load a program's lines into an editor as text, converting legacy words but keeping
+        invalid ones. Binary images are shown as their 6-digit words.'''
+        from sources import program_source
+        from validator import parse_program
+        from image import image_array
+        with program_source(source) as program:
+            if isinstance(program, (bytes, bytearray, memoryview, mmap)):
+                try:
+                    object.memory = [format_word(word) for word in image_array(program)]
+                except (VMError, MemoryError):
+                    # The load itself already reported why the image was refused
+                    object.memory = []
+                return
+            object.memory = parse_program(program, require_halt=False, keep_text=True).texts
 
 if __name__ == "__main__":
-    vm = VM()
-    pl = ProgramLoader()
-    pl.load(vm, "test_files/6-digit-test.txt")
-    vm.run()
-    print("\nFINAL STATE")
-    print(vm)
\ No newline at end of file
+    from cli import main
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,216 @@
+import atexit
+import time
+from array import array
+from multiprocessing import Pipe, Process
+from multiprocessing.shared_memory import SharedMemory
+from config import *
+from vm import VM, RunControl, ExecutionStoppedError
+from channels import Channel
+from events import OutputEvent, InputRequestEvent, StateChangedEvent, HaltedEvent, ErrorEvent
+
+# Layout of the shared block: these registers, then MEMORY_LENGTH memory words, all int64
+PC, ACCUMULATOR, INSTRUCTIONS, OVERFLOWS, PUBLISHED_NS = range(5)
+REGISTERS = 5
+
+EVENT_TYPES = {
+    "output": OutputEvent,
+    "input-request": InputRequestEvent,
+    "state-changed": StateChangedEvent,
+    "halted": HaltedEvent,
+    "error": ErrorEvent
+}
+
+class WorkerVM(VM):
+    '''VM living in a worker process whose memory and registers are a shared memory block'''
+    def __init__(self, state: memoryview, engine: str = "interpreter"):
+        super().__init__(engine=engine)
+        self.state = state
+        self.attach_memory(state[REGISTERS:])
+
+    def load_registers(self):
+        '''Pick up registers and memory the GUI process wrote while this VM was idle'''
+        self.program_counter, self.accumulator, self.instruction_count, self.overflow_count = self.state[:REGISTERS - 1]
+        self.memory_changed()
+
+    def publish(self):
+        super().publish()
+        self.state[:REGISTERS] = array("q", [self.program_counter, self.accumulator, self.instruction_count,
+                                             self.overflow_count, time.perf_counter_ns()])
+
+class PipeControl(RunControl):
+    '''RunControl driven by pause/resume/stop commands arriving on the worker's pipe'''
+    def __init__(self, conn):
+        super().__init__()
+        self.conn = conn
+
+    def handle(self, command: str, *args):
+        if command == "pause":
+            self.pause()
+        elif command == "resume":
+            self.resume()
+        elif command == "stop":
+            self.stop()
+
+    def wait(self) -> bool:
+        # While paused, block until the next command; otherwise only take what already arrived
+        while self.conn.poll(None if self.paused else 0):
+            self.handle(*self.conn.recv())
+        return not self.stopped
+
+class PipeChannel(Channel):
+    '''I/O channel of a worker's VM: output and input requests go to the GUI over the pipe'''
+    def __init__(self, conn, control: PipeControl):
+        self.conn = conn
+        self.control = control
+
+    def read(self, prompt: str = "") -> str:
+        self.conn.send(("input-request", prompt))
+        while True:
+            command, *args = self.conn.recv()
+            if command == "input":
+                return args[0]
+            # Pause/resume/stop can arrive while the program waits for input
+            self.control.handle(command, *args)
+            if self.control.stopped:
+                raise ExecutionStoppedError(ERR_STOPPED)
+
+    def write(self, text: str):
+        self.conn.send(("output", text))
+
+def worker_main(shm_name: str, conn, engine: str):
+    '''Worker process entry point: execute commands from conn on a VM backed by shared memory'''
+    shm = SharedMemory(name=shm_name)
+    vm = WorkerVM(shm.buf.cast("q"), engine)
+    vm.publish_interval = LIVE_PUBLISH_INTERVAL
+    vm.control = PipeControl(conn)
+
+    channel = PipeChannel(conn, vm.control)
+    vm.set_io(channel, channel)
+    while True:
+        try:
+            command, *args = conn.recv()
+        except EOFError:
+            break
+        if command == "run":
+            vm.control.reset()
+            vm.load_registers()
+            try:
+                vm.run()
+                conn.send(("halted",))
+            except Exception as e:
+                conn.send(("error", str(e)))
+            finally:
+                vm.publish()
+                conn.send(("state-changed",))
+
+class ProcessWorker:
+    '''Runs a tab's programs in a separate process so they never hold the GUI's GIL.
+
+    The program counter, accumulator, counters and memory live in a shared
+    memory block. The GUI's own VM is attached to the same memory, so loading,
+    editing and drawing read and write it directly without copies, and the
+    registers are copied into the GUI's VM whenever the worker reports a state
+    change. Commands and I/O travel over a pipe; poll() turns the worker's
+    messages into events on the tab's EventChannel. pause(), resume() and
+    stop() are checked by the running VM between slices; kill() is the last
+    resort, replacing the process with a fresh worker on the same shared state.
+    It is used when stop() is requested a second time, or when the run has not
+    ended WORKER_STOP_TIMEOUT seconds after the first request.
+    '''
+    def __init__(self, vm: VM, events, engine: str = "interpreter"):
+        self.vm = vm
+        self.events = events
+        self.engine = engine
+        self.running = False
+        self.stop_requested = None  # time.monotonic() of the pending cooperative stop
+        self.shm = SharedMemory(create=True, size=(REGISTERS + MEMORY_LENGTH) * 8)
+        self.state = self.shm.buf.cast("q")
+        self.state[REGISTERS:] = vm._words
+        vm.attach_memory(self.state[REGISTERS:])
+        self.process = None
+        self.start()
+        atexit.register(self.close)
+
+    def start(self):
+        self.conn, child_conn = Pipe()
+        self.process = Process(target=worker_main, args=(self.shm.name, child_conn, self.engine), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def run(self):
+        '''Start running from the GUI VM's current registers'''
+        vm = self.vm
+        self.state[:REGISTERS - 1] = array("q", [vm.program_counter, vm.accumulator, vm.instruction_count, vm.overflow_count])
+        self.state[PUBLISHED_NS] = 0
+        self.running = True
+        self.stop_requested = None
+        self.conn.send(("run",))
+
+    def send_input(self, text: str):
+        self.conn.send(("input", text))
+
+    def pause(self):
+        self.conn.send(("pause",))
+
+    def resume(self):
+        self.conn.send(("resume",))
+
+    def stop(self):
+        '''Ask the program to stop; a second request, or one that times out in poll(), kills it'''
+        if self.stop_requested is not None:
+            self.kill()
+            return
+        self.stop_requested = time.monotonic()
+        self.conn.send(("stop",))
+
+    def published(self):
+        '''The registers as last published by the worker, in the same form as VM.published'''
+        if not self.state[PUBLISHED_NS]:
+            return None
+        return (self.state[PC], self.state[ACCUMULATOR], self.state[INSTRUCTIONS], self.state[PUBLISHED_NS] / 1e9)
+
+    def poll(self):
+        '''Turn every message the worker has sent into an event; call from the Tk thread'''
+        while self.conn.poll():
+            kind, *args = self.conn.recv()
+            if kind == "state-changed":
+                self.running = False
+                self.stop_requested = None
+                self.pull_registers()
+            self.events.post(EVENT_TYPES[kind](*args))
+        if self.running and self.stop_requested is not None and time.monotonic() - self.stop_requested > WORKER_STOP_TIMEOUT:
+            self.kill()
+
+    def pull_registers(self):
+        vm = self.vm
+        vm.program_counter, vm.accumulator, vm.instruction_count, vm.overflow_count = self.state[:REGISTERS - 1]
+        vm.memory_changed()
+
+    def kill(self):
+        '''Kill a running program and replace the worker, keeping the state it reached'''
+        if not self.running:
+            return
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+        self.running = False
+        self.stop_requested = None
+        self.pull_registers()
+        self.events.post(ErrorEvent(ERR_STOPPED))
+        self.events.post(StateChangedEvent())
+        self.start()
+
+    def close(self):
+        if self.process is None:
+            return
+        self.process.terminate()
+        self.process.join()
+        self.process = None
+        self.conn.close()
+        # The GUI VM keeps a private copy so it stays usable after the block is gone
+        words = array("q", self.state[REGISTERS:])
+        self.vm.attach_memory(words)
+        self.state.release()
+        self.shm.close()
+        self.shm.unlink()
+        atexit.unregister(self.close)